@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+class FileCache(object):
+    """
+    Small JSON file cache
+
+    Each entry is stored in its own file, readable by the owner only, and
+    carries the time it was written so readers can apply a TTL.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(directory)
+        self.logger = logging.getLogger()
+
+    def path(self, key):
+        """
+        Returns the file name used for a cache key
+
+        Args:
+            key (str): The cache key
+
+        Returns:
+            The path of the cache file
+
+        """
+        name = hashlib.sha1(key.encode('utf8')).hexdigest()
+
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, key, ttl=None):
+        """
+        Retrieves a cache entry
+
+        Args:
+            key (str): The cache key
+            ttl (int): Maximum age of the entry in seconds, None for no limit
+
+        Returns:
+            The cached value or None if it is missing or expired
+
+        """
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if ttl is not None and time.time() - entry.get('time', 0) > ttl:
+            return None
+
+        return entry.get('value')
+
+    def set(self, key, value):
+        """
+        Stores a cache entry
+
+        Failures are logged and otherwise ignored, a missing cache entry
+        only costs another lookup on the next run.
+
+        Args:
+            key     (str): The cache key
+            value        : A JSON serializable value
+
+        """
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'time': time.time(), 'value': value}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warning('Unable to write cache file %s: %s' % (path, e))
+
+    def delete(self, key):
+        """
+        Removes a cache entry
+
+        Args:
+            key (str): The cache key
+
+        """
+        try:
+            os.unlink(self.path(key))
+        except OSError:
+            pass
@@ -2,6 +2,9 @@ import ldap
 import ldap.filter
 import logging
 
+from ldap.controls import SimplePagedResultsControl
+
+from filecache import FileCache
 
 
 class LDAPConn(object):
@@ -28,30 +31,17 @@ class LDAPConn(object):
         self.lowercase = config.ldap_lowercase
         self.user_filter = config.ldap_user_filter
         self.active_directory = config.ldap_active_directory
+        self.openldap_type = config.openldap_type
+        self.group_name_attribute = config.ldap_group_name_attribute
+        self.page_size = config.ldap_page_size
+        self.groups_ttl = config.cache_groups_ttl
+        self.cache = FileCache(config.cache_dir)
         self.verbose = config.verbose
 
-        # Use logger to log information
         self.logger = logging.getLogger()
-        if self.verbose:
-            self.logger.setLevel(logging.DEBUG)
-        else:
-            self.logger.setLevel(logging.INFO)
-
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-        # Log to stdout
-        ch = logging.StreamHandler()
-        if self.verbose:
-             ch.setLevel(logging.DEBUG)
-
-        ch.setFormatter(formatter)
-        self.logger.addHandler(ch)  # Use logger to log information
 
-        # Log from pyldap
-        log = logging.getLogger('ldap')
-        log.addHandler(ch)
+        # Debug output from libldap
         if self.verbose:
-            log.setLevel(logging.DEBUG)
             ldap.set_option(ldap.OPT_DEBUG_LEVEL, 4095)
 
     def connect(self):
@@ -77,6 +67,19 @@ class LDAPConn(object):
         """
         self.conn.unbind()
 
+    def prefetch(self, groups):
+        """
+        Prepares the retrieval of the given groups
+
+        Nothing to do for a single LDAP server, the members of each group
+        are retrieved by get_group_members.
+
+        Args:
+            groups (list): The LDAP group names
+
+        """
+        pass
+
     def remove_ad_referrals(self, result):
         """
         Remove referrals from AD query result
@@ -175,10 +178,9 @@ class LDAPConn(object):
 
             final_listing = {}
 
-            group_members = []
-
             # Get info for each user in the group
             for memberid in users[self.group_member_attribute]:
+                memberid = memberid.decode('utf8')
 
                 if self.openldap_type == "groupofnames":
                     filter = "(objectClass=*)"
@@ -198,144 +200,142 @@ class LDAPConn(object):
                                          filterstr=filter,
                                          attrlist=attrlist)
 
-                for item in uid:
-                    group_members.append(item)
-
                 # Fill dictionary with usernames and corresponding DNs
-                for item in group_members:
-                    dn = item[0]
-                    username = item[1][self.uid_attribute]
-                    user = ''.join(username)
-
-                final_listing[user] = dn
+                for dn, attrs in uid:
+                    final_listing[attrs[self.uid_attribute][0].decode('utf8')] = dn
 
             return final_listing
 
-    def get_groups_with_wildcard(self, groups_wildcard):
-        self.logger.info("Search group with wildcard: %s" % groups_wildcard)
-
-        filter = self.group_filter % groups_wildcard
-        result_groups = []
+    def paged_search(self, filterstr, attrlist):
+        """
+        Performs a subtree search below the base DN using paged results
 
-        result = self.conn.search_s(base=self.base,
-                                    scope=ldap.SCOPE_SUBTREE,
-                                    filterstr=filter, )
+        Args:
+            filterstr  (str): The LDAP filter
+            attrlist  (list): The attributes to retrieve
 
-        for group in result:
-            # Skip refldap (when Active Directory used)
-            # [0]==None
-            if group[0]:
-                group_name = group[1]['name'][0]
-                self.logger.info("Find group %s" % group_name)
-                result_groups.append(group_name)
+        Returns:
+            A list of (dn, attrs) tuples
 
-        if not result_groups:
-            self.logger.info('Unable to find group "%s", skipping group wildcard' % groups_wildcard)
+        """
+        page_control = SimplePagedResultsControl(True, size=self.page_size, cookie='')
+        result = []
 
-        return result_groups
+        while True:
+            msgid = self.conn.search_ext(base=self.base,
+                                         scope=ldap.SCOPE_SUBTREE,
+                                         filterstr=filterstr,
+                                         attrlist=attrlist,
+                                         serverctrls=[page_control])
+            rtype, rdata, rmsgid, serverctrls = self.conn.result3(msgid)
+            result.extend(rdata)
 
-    def get_user_media(self, dn, ldap_media):
-        """
-        Retrieves the 'media' attribute of an LDAP user
+            cookies = [c.cookie for c in serverctrls
+                       if c.controlType == SimplePagedResultsControl.controlType]
+            if not cookies or not cookies[0]:
+                break
 
-        Args:
-            username (str): The LDAP distinguished name to lookup
-            ldap_media (str): The name of the field containing the media address
+            page_control.cookie = cookies[0]
 
-        Returns:
-            The user's media attribute value
+        return result
 
+    def get_groups_with_wildcard(self, groups_wildcard):
         """
-        attrlist = [ldap_media]
-
-        result = self.conn.search_s(base=dn,
-                                    scope=ldap.SCOPE_BASE,
-                                    attrlist=attrlist)
+        Retrieves the names of the LDAP groups matching wildcard patterns
 
-        if not result:
-            return None
+        Args:
+            groups_wildcard (list): The group name patterns
 
-        dn, data = result.pop()
+        Returns:
+            A list of group names
 
-        mail = data.get(ldap_media)
+        Raises:
+            SystemExit
 
-        if not mail:
-            return None
+        """
+        result_groups = self.search_groups_with_wildcard(groups_wildcard)
+        if not result_groups:
+            raise SystemExit('ERROR - No groups found with wildcard')
 
-        return mail.pop()
+        return result_groups
 
-    def get_user_sn(self, dn):
+    def search_groups_with_wildcard(self, groups_wildcard):
         """
-        Retrieves the 'sn' attribute of an LDAP user
+        Searches the LDAP groups matching wildcard patterns
+
+        All patterns are combined in one OR filter and only the group
+        naming attribute is requested. A non-empty result is cached for
+        ``groups_ttl`` seconds.
 
         Args:
-            username (str): The LDAP distinguished name to lookup
+            groups_wildcard (list): The group name patterns
 
         Returns:
-            The user's surname attribute
+            A list of group names, empty if no group matches
 
         """
-        attrlist = ['sn']
+        self.logger.info("Search group with wildcard: %s" % ', '.join(groups_wildcard))
 
-        result = self.conn.search_s(base=dn,
-                                    scope=ldap.SCOPE_BASE,
-                                    attrlist=attrlist)
+        filters = [self.group_filter % i for i in groups_wildcard]
+        if len(filters) == 1:
+            filter = filters[0]
+        else:
+            filter = '(|%s)' % ''.join(filters)
 
-        if not result:
-            return None
+        cache_key = 'groups:%s:%s:%s:%s' % (self.uri, self.base, filter, self.group_name_attribute)
+        if self.groups_ttl > 0:
+            result_groups = self.cache.get(cache_key, self.groups_ttl)
+            if result_groups:
+                self.logger.info("Using %d cached groups for wildcard search" % len(result_groups))
+                return result_groups
 
-        dn, data = result.pop()
+        self.connect()
+        try:
+            result = self.paged_search(filter, [self.group_name_attribute])
+        finally:
+            self.disconnect()
 
-        sn = data.get('sn')
+        result_groups = []
+        # Skip referrals (when Active Directory used)
+        for dn, attrs in self.remove_ad_referrals(result):
+            names = attrs.get(self.group_name_attribute)
+            if names:
+                group_name = names[0].decode('utf8')
+                self.logger.info("Find group %s" % group_name)
+                result_groups.append(group_name)
 
-        if not sn:
-            return None
+        if result_groups and self.groups_ttl > 0:
+            self.cache.set(cache_key, result_groups)
 
-        return sn.pop()
+        return result_groups
 
-    def get_user_givenName(self, dn):
+    def get_user_attributes(self, dn, attributes):
         """
-        Retrieves the 'givenName' attribute of an LDAP user
+        Retrieves attributes of an LDAP user with a single search
 
         Args:
-            username (str): The LDAP distinguished name to lookup
+            dn          (str): The LDAP distinguished name to lookup
+            attributes (list): The names of the attributes
 
         Returns:
-            The user's given name attribute
+            A dict with the first value of each attribute, or None for
+            missing attributes
 
         """
-        attrlist = ['givenName']
+        values = dict.fromkeys(attributes)
 
         result = self.conn.search_s(base=dn,
                                     scope=ldap.SCOPE_BASE,
-                                    attrlist=attrlist)
+                                    attrlist=attributes)
 
         if not result:
-            return None
+            return values
 
         dn, data = result.pop()
 
-        name = data.get('givenName')
-
-        if not name:
-            return None
-
-        return name.pop()
-
-    def get_groups_with_wildcard(self):
-        """
-        Set group from LDAP with wildcard
-        :return:
-        """
-        result_groups = []
-        ldap_conn = LDAPConn(self.ldap_uri, self.ldap_base, self.ldap_user, self.ldap_pass)
-        ldap_conn.connect()
-
-        for group in self.ldap_groups:
-            groups = ldap_conn.get_groups_with_wildcard(group)
-            result_groups = result_groups + groups
-
-        if not result_groups:
-            raise SystemExit('ERROR - No groups found with wildcard')
+        for attribute in attributes:
+            value = data.get(attribute)
+            if value:
+                values[attribute] = value[0].decode('utf8')
 
-        return result_groups
\ No newline at end of file
+        return values
@@ -0,0 +1,172 @@
+import concurrent.futures
+import logging
+
+
+class MultiLDAPConn(object):
+    """
+    Connector for several LDAP sources
+
+    Provides the LDAPConn methods used by the sync. The sources are
+    queried concurrently, one thread per source, and their group members
+    are merged. A username found in several sources is taken from the
+    source with the lowest precedence value.
+
+    Every source is accessed through its own instance of the connector
+    class, normally LDAPConn.
+
+    """
+
+    def __init__(self, sources, connector):
+        self.sources = sorted(sources, key=lambda s: s.precedence)
+        self.conns = [connector(s) for s in self.sources]
+        self.logger = logging.getLogger()
+
+        self.members = {}
+        self.owners = {}
+
+    def run(self, func):
+        """
+        Runs a function for every source concurrently
+
+        Args:
+            func (callable): Function taking an LDAPConn
+
+        Returns:
+            A list of the results, in the order of the sources
+
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.conns)) as executor:
+            return list(executor.map(func, self.conns))
+
+    def connect(self):
+        """
+        Establishes connections to all LDAP sources
+
+        If any source fails, the sources already bound are disconnected
+        again before the error is raised.
+
+        Raises:
+            SystemExit
+
+        """
+        def connect(conn):
+            try:
+                conn.connect()
+            except (Exception, SystemExit) as e:
+                return e
+
+        errors = self.run(connect)
+
+        failed = [e for e in errors if e is not None]
+        if failed:
+            connected = [conn for conn, e in zip(self.conns, errors) if e is None]
+            for conn in connected:
+                conn.disconnect()
+            raise failed[0]
+
+    def disconnect(self):
+        """
+        Disconnects from all LDAP sources
+
+        """
+        self.run(lambda conn: conn.disconnect())
+
+    def get_groups_with_wildcard(self, groups_wildcard):
+        """
+        Retrieves the names of the groups matching wildcard patterns in any source
+
+        Args:
+            groups_wildcard (list): The group name patterns
+
+        Returns:
+            A list of group names
+
+        Raises:
+            SystemExit
+
+        """
+        results = self.run(lambda conn: conn.search_groups_with_wildcard(groups_wildcard))
+
+        result_groups = []
+        for source, groups in zip(self.sources, results):
+            if not groups:
+                self.logger.info('No groups found with wildcard in LDAP source %s' % source.name)
+            result_groups.extend(g for g in groups if g not in result_groups)
+
+        if not result_groups:
+            raise SystemExit('ERROR - No groups found with wildcard')
+
+        return result_groups
+
+    def prefetch(self, groups):
+        """
+        Retrieves and merges the members of all groups from all sources
+
+        Args:
+            groups (list): The LDAP group names
+
+        """
+        results = self.run(lambda conn: {group: conn.get_group_members(group) for group in groups})
+
+        # Resolve every username to one source, over all groups
+        winners = {}
+        for source, conn, result in zip(self.sources, self.conns, results):
+            for members in result.values():
+                for username, dn in (members or {}).items():
+                    if username not in winners:
+                        winners[username] = (source, conn, dn)
+                    elif winners[username][0] is not source:
+                        self.logger.debug('User "%s" exists in LDAP sources %s and %s, using %s'
+                                          % (username, winners[username][0].name, source.name,
+                                             winners[username][0].name))
+
+        for source, conn, dn in winners.values():
+            self.owners[dn] = conn
+
+        for group in groups:
+            found = [result[group] for result in results if result[group] is not None]
+            if not found:
+                self.members[group] = None
+                continue
+
+            merged = {}
+            for members in found:
+                for username in members:
+                    merged[username] = winners[username][2]
+            self.members[group] = merged
+
+    def get_group_members(self, group):
+        """
+        Retrieves the merged members of an LDAP group
+
+        Args:
+            group (str): The LDAP group name
+
+        Returns:
+            A dict of the usernames and DNs of the group members, or None
+            if no source has the group
+
+        """
+        if group not in self.members:
+            self.prefetch([group])
+
+        return self.members[group]
+
+    def get_user_attributes(self, dn, attributes):
+        """
+        Retrieves attributes of an LDAP user from the source it belongs to
+
+        Args:
+            dn          (str): The LDAP distinguished name to lookup
+            attributes (list): The names of the attributes
+
+        Returns:
+            A dict with the first value of each attribute, or None for
+            missing attributes
+
+        """
+        conn = self.owners.get(dn)
+        if conn is None:
+            return dict.fromkeys(attributes)
+
+        return conn.get_user_attributes(dn, attributes)
@@ -0,0 +1,159 @@
+import datetime
+import gzip
+import json
+import logging
+
+SNAPSHOT_FORMAT = 'zabbix-ldap-sync-snapshot'
+SNAPSHOT_VERSION = 1
+
+
+def export_snapshot(ldap_conn, groups, attributes, path):
+    """
+    Writes the LDAP groups, their members and user attributes to a file
+
+    The file is gzip compressed JSON. Every user is stored once, groups
+    refer to users by their index in the user list:
+
+        {"format": ..., "version": 1, "created": ..., "attributes": [...],
+         "users": [[username, dn, value, ...], ...],
+         "groups": {"group": [0, 1, ...], ...}}
+
+    Args:
+        ldap_conn   (LDAPConn): Connection to the LDAP server
+        groups          (list): The LDAP group names
+        attributes      (list): The user attributes to store
+        path             (str): The output file
+
+    """
+    logger = logging.getLogger()
+
+    users = []
+    user_index = {}
+    snapshot_groups = {}
+
+    ldap_conn.connect()
+
+    try:
+        ldap_conn.prefetch(groups)
+
+        for group in groups:
+            members = ldap_conn.get_group_members(group)
+            if members is None:
+                continue
+
+            indexes = []
+            for username, dn in members.items():
+                if username not in user_index:
+                    values = ldap_conn.get_user_attributes(dn, attributes)
+                    user_index[username] = len(users)
+                    users.append([username, dn] + [values[a] for a in attributes])
+                indexes.append(user_index[username])
+
+            snapshot_groups[group] = sorted(indexes)
+    finally:
+        ldap_conn.disconnect()
+
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'attributes': attributes,
+        'users': users,
+        'groups': snapshot_groups,
+    }
+
+    with gzip.open(path, 'wt', encoding='utf8') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+
+    logger.info('Exported %d groups with %d users to %s' % (len(snapshot_groups), len(users), path))
+
+
+class SnapshotLDAPConn(object):
+    """
+    LDAP snapshot connector class
+
+    Provides the LDAPConn methods used by the sync, answered from a file
+    written by export_snapshot instead of an LDAP server.
+
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger()
+
+        try:
+            with gzip.open(path, 'rt', encoding='utf8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            raise SystemExit('Cannot read LDAP snapshot %s: %s' % (path, e))
+
+        if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != SNAPSHOT_VERSION:
+            raise SystemExit('Unsupported LDAP snapshot %s' % path)
+
+        self.attributes = snapshot['attributes']
+        self.users = snapshot['users']
+        self.groups = snapshot['groups']
+        self.user_index = {user[1]: i for i, user in enumerate(self.users)}
+
+        self.logger.info('Loaded LDAP snapshot %s created %s' % (path, snapshot['created']))
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def prefetch(self, groups):
+        pass
+
+    def get_groups_with_wildcard(self, groups_wildcard):
+        """
+        Returns the groups stored in the snapshot
+
+        Wildcards were already resolved when the snapshot was exported.
+
+        """
+        return list(self.groups)
+
+    def get_group_members(self, group):
+        """
+        Retrieves the members of an LDAP group
+
+        Args:
+            group (str): The LDAP group name
+
+        Returns:
+            A dict of the usernames and DNs of the group members, or None
+            if the group is not in the snapshot
+
+        """
+        if group not in self.groups:
+            self.logger.info('Group "%s" is not in the LDAP snapshot, skipping group' % group)
+            return None
+
+        return {self.users[i][0]: self.users[i][1] for i in self.groups[group]}
+
+    def get_user_attributes(self, dn, attributes):
+        """
+        Retrieves attributes of an LDAP user
+
+        Args:
+            dn          (str): The LDAP distinguished name to lookup
+            attributes (list): The names of the attributes
+
+        Returns:
+            A dict with the value of each attribute, or None for
+            attributes missing from the snapshot
+
+        """
+        values = dict.fromkeys(attributes)
+
+        index = self.user_index.get(dn)
+        if index is None:
+            return values
+
+        user = self.users[index]
+        for attribute in attributes:
+            if attribute in self.attributes:
+                values[attribute] = user[2 + self.attributes.index(attribute)]
+
+        return values
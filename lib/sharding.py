@@ -0,0 +1,373 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+
+def shard_of(name, count):
+    """
+    Returns the shard a group belongs to
+
+    The result only depends on the name, so every worker computes the
+    same assignment without coordination.
+
+    Args:
+        name   (str): The group name
+        count  (int): The number of shards
+
+    Returns:
+        The shard index
+
+    """
+    return zlib.crc32(name.encode('utf8')) % count
+
+
+def select_shard(groups, index, count):
+    """
+    Selects the groups of one shard
+
+    Args:
+        groups (list): All group names
+        index   (int): The shard index
+        count   (int): The number of shards
+
+    Returns:
+        A list of the group names belonging to the shard
+
+    """
+    return [g for g in groups if shard_of(g, count) == index]
+
+
+class LeaseTimeout(Exception):
+    """
+    Raised when a lease cannot be acquired in time
+
+    """
+
+
+class LeaseLock(object):
+    """
+    File based leases shared between sync workers
+
+    A lease is a file in a directory shared by all workers, holding the
+    owner and the time the lease expires. Lease files are written to a
+    temporary file first and linked into place, so they are never seen
+    half written. Leases of workers which died are taken over once they
+    have expired.
+
+    Short leases are owned by the process, so two runs of the same shard
+    exclude each other. The run lease of the worker is held by start()
+    until stop(), and renewed by a background thread. Claims are owned by
+    the worker and stay valid for as long as its run lease, so only that
+    one file is renewed however many claims the worker holds.
+
+    """
+
+    def __init__(self, directory, worker, lease_time):
+        self.directory = os.path.expanduser(directory)
+        self.worker = worker
+        self.owner = '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lease_time = lease_time
+        self.logger = logging.getLogger()
+
+        self.claims = set()
+        self.heartbeat = None
+        self.stopping = threading.Event()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, name):
+        """
+        Returns the lease file name for a name
+
+        Args:
+            name (str): The name of the lease
+
+        Returns:
+            The path of the lease file
+
+        """
+        return os.path.join(self.directory, hashlib.sha1(name.encode('utf8')).hexdigest() + '.lease')
+
+    def read(self, path):
+        """
+        Reads a lease file
+
+        Returns:
+            The lease dict or None if the file is missing or incomplete
+
+        """
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, path, owner=None, replace=False):
+        """
+        Writes a lease file
+
+        Args:
+            path      (str): The path of the lease file
+            owner     (str): The owner of the lease, this process by default
+            replace  (bool): Replace an existing lease file
+
+        Raises:
+            FileExistsError: if the lease file exists and replace is False
+
+        """
+        tmp = '%s.%s.tmp' % (path, self.owner)
+
+        with open(tmp, 'w') as f:
+            json.dump({'owner': owner or self.owner, 'expires': time.time() + self.lease_time}, f)
+
+        try:
+            if replace:
+                os.replace(tmp, path)
+            else:
+                os.link(tmp, path)
+        finally:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+
+    def expired(self, path, lease):
+        """
+        Checks whether a lease has expired
+
+        A lease file which cannot be read, e.g. one left empty by an
+        older version, expires leasetime seconds after it was written.
+
+        Args:
+            path   (str): The path of the lease file
+            lease (dict): The lease read from the file, or None
+
+        """
+        if lease:
+            return lease['expires'] < time.time()
+
+        try:
+            return os.stat(path).st_mtime + self.lease_time < time.time()
+        except FileNotFoundError:
+            return False
+
+    def break_expired(self, path, lease):
+        """
+        Removes an expired lease
+
+        The file is renamed first, so only one worker removes it. If the
+        renamed file turns out to be a fresh lease, it is put back.
+
+        """
+        stale = '%s.%s.stale' % (path, self.owner)
+
+        try:
+            os.rename(path, stale)
+        except OSError:
+            return
+
+        if self.read(stale) != lease:
+            try:
+                os.link(stale, path)
+            except OSError:
+                pass
+
+        os.unlink(stale)
+
+    def acquire(self, name, timeout=None):
+        """
+        Acquires a lease
+
+        Args:
+            name     (str): The name of the lease
+            timeout  (int): Seconds to wait for the lease, None waits forever
+
+        Returns:
+            True if the lease is held by this process, False otherwise
+
+        """
+        path = self.path(name)
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            try:
+                self.write(path)
+                return True
+            except FileExistsError:
+                pass
+
+            lease = self.read(path)
+            if lease and lease['owner'] == self.owner:
+                self.write(path, replace=True)
+                return True
+
+            if self.expired(path, lease):
+                self.logger.info('Taking over expired lease of %s' % (lease['owner'] if lease else 'unknown owner'))
+                self.break_expired(path, lease)
+                continue
+
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+            time.sleep(0.05)
+
+    def release(self, name):
+        """
+        Releases a lease held by this process
+
+        Args:
+            name (str): The name of the lease
+
+        """
+        path = self.path(name)
+        lease = self.read(path)
+
+        if lease and lease['owner'] == self.owner:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    @contextlib.contextmanager
+    def lease(self, name, timeout=None):
+        """
+        Holds a lease for the duration of a with block
+
+        Args:
+            name     (str): The name of the lease
+            timeout  (int): Seconds to wait for the lease, None waits forever
+
+        Raises:
+            LeaseTimeout
+
+        """
+        if not self.acquire(name, timeout):
+            raise LeaseTimeout('Unable to acquire lease %s' % name)
+
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def start(self):
+        """
+        Starts the run of this worker
+
+        Takes the run lease of the worker and renews it every third of the
+        lease time from a background thread until stop() is called.
+
+        Returns:
+            False if another process runs as the same worker
+
+        """
+        if not self.acquire('run:%s' % self.worker, timeout=0):
+            return False
+
+        self.stopping.clear()
+        self.heartbeat = threading.Thread(target=self.renew_run, name='lease-heartbeat', daemon=True)
+        self.heartbeat.start()
+
+        return True
+
+    def stop(self):
+        """
+        Ends the run of this worker and releases the run lease
+
+        """
+        if self.heartbeat is None:
+            return
+
+        self.stopping.set()
+        self.heartbeat.join()
+        self.heartbeat = None
+
+        self.release('run:%s' % self.worker)
+
+    def renew_run(self):
+        """
+        Renews the run lease until the run is stopped
+
+        """
+        path = self.path('run:%s' % self.worker)
+
+        while not self.stopping.wait(self.lease_time / 3):
+            lease = self.read(path)
+            if not lease or lease['owner'] != self.owner:
+                self.logger.warning('Lost run lease of worker %s' % self.worker)
+                return
+            self.write(path, replace=True)
+
+    def running(self, worker):
+        """
+        Checks whether a worker holds a live run lease
+
+        Args:
+            worker (str): The worker name
+
+        """
+        path = self.path('run:%s' % worker)
+        lease = self.read(path)
+
+        return lease is not None and not self.expired(path, lease)
+
+    def claim(self, name):
+        """
+        Claims a name for this worker
+
+        A claim stays with the worker across runs, and is taken over by
+        another worker only while its owner is not running.
+
+        Args:
+            name (str): The name of the claim
+
+        Returns:
+            True if the claim is held by this worker, False otherwise
+
+        """
+        if name in self.claims:
+            return True
+
+        path = self.path(name)
+
+        while True:
+            try:
+                self.write(path, owner=self.worker)
+                break
+            except FileExistsError:
+                pass
+
+            lease = self.read(path)
+            if lease and lease['owner'] == self.worker:
+                break
+
+            if (lease and self.running(lease['owner'])) or (not lease and not self.expired(path, lease)):
+                return False
+
+            self.break_expired(path, lease)
+
+        self.claims.add(name)
+
+        return True
+
+
+def worker_id(index, count):
+    """
+    Returns a name identifying this worker
+
+    The name is stable across runs and hosts, so a worker keeps the users
+    it owns from one run to the next, and only one process at a time runs
+    a shard.
+
+    Args:
+        index (int): The shard index
+        count (int): The number of shards
+
+    """
+    return 'shard %d/%d' % (index, count)
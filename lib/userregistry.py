@@ -0,0 +1,108 @@
+import sys
+
+
+class UserRecord(object):
+    """
+    A user known to LDAP and/or Zabbix
+
+    """
+    __slots__ = ('id', 'username', 'dn')
+
+    def __init__(self, id, username, dn=None):
+        self.id = id
+        self.username = username
+        self.dn = dn
+
+
+class UserRegistry(object):
+    """
+    Compact registry of LDAP and Zabbix users
+
+    Every username is stored once, as an interned string in a UserRecord,
+    and addressed by an integer id. Group members are returned as sets of
+    ids, so diffs between LDAP and Zabbix groups are plain set operations.
+
+    """
+
+    def __init__(self):
+        self.records = []
+        self.ids = {}
+
+    def add(self, username, dn=None):
+        """
+        Registers a user
+
+        Args:
+            username (str): The username
+            dn       (str): The LDAP distinguished name of the user, if known
+
+        Returns:
+            The id of the user
+
+        """
+        id = self.ids.get(username)
+
+        if id is None:
+            username = sys.intern(username)
+            id = len(self.records)
+            self.records.append(UserRecord(id, username))
+            self.ids[username] = id
+
+        if dn is not None:
+            record = self.records[id]
+            if record.dn != dn:
+                record.dn = sys.intern(dn)
+
+        return id
+
+    def add_users(self, usernames):
+        """
+        Registers a list of users
+
+        Args:
+            usernames (list): The usernames
+
+        Returns:
+            A set with the ids of the users
+
+        """
+        return {self.add(username) for username in usernames}
+
+    def add_group_members(self, members):
+        """
+        Registers the members of an LDAP group
+
+        Args:
+            members (dict): The usernames and DNs of the group members
+
+        Returns:
+            A set with the ids of the group members
+
+        """
+        return {self.add(username, dn) for username, dn in members.items()}
+
+    def get(self, id):
+        """
+        Retrieves the record of a user
+
+        Args:
+            id (int): The id of the user
+
+        Returns:
+            The UserRecord of the user
+
+        """
+        return self.records[id]
+
+    def usernames(self, ids):
+        """
+        Retrieves the usernames for a set of ids
+
+        Args:
+            ids (set): The ids of the users
+
+        Returns:
+            A sorted list of usernames
+
+        """
+        return sorted(self.records[id].username for id in ids)
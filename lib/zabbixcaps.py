@@ -0,0 +1,50 @@
+import re
+
+
+class ZabbixCapabilities(object):
+    """
+    Zabbix API capabilities class
+
+    Selects the API calls and field names to use, based on the version
+    reported by ``apiinfo.version``.
+
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.version_info = tuple(int(i) for i in re.findall(r'\d+', version)[:2])
+
+        # The user 'alias' field was renamed in 5.4
+        if self.version_info >= (5, 4):
+            self.username_field = 'username'
+        else:
+            self.username_field = 'alias'
+
+        # The media type 'description' field was renamed in 4.4
+        if self.version_info >= (4, 4):
+            self.mediatype_name_field = 'name'
+        else:
+            self.mediatype_name_field = 'description'
+
+        # user.addmedia/user.deletemedia and usergroup.massadd are gone in 4.0,
+        # media and groups are replaced through user.update instead
+        if self.version_info >= (5, 2):
+            self.media_update = 'medias'
+        elif self.version_info >= (4, 0):
+            self.media_update = 'user_medias'
+        else:
+            self.media_update = None
+
+        self.usergroup_massadd = self.version_info < (4, 0)
+
+        # Email media take a list of addresses since 4.0
+        self.sendto_list = self.version_info >= (4, 0)
+
+        # User types were replaced by roles in 5.2
+        self.user_roles = self.version_info >= (5, 2)
+
+        # API tokens are sent in the Authorization header since 6.4
+        self.auth_header = self.version_info >= (6, 4)
+
+    def __str__(self):
+        return self.version
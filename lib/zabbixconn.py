@@ -1,11 +1,24 @@
+import contextlib
 import logging
 import random
 import string
 import collections
 import re
+import sys
 
 from pyzabbix import ZabbixAPI, ZabbixAPIException
 
+from filecache import FileCache
+from sharding import LeaseLock, LeaseTimeout, select_shard, worker_id
+from userregistry import UserRegistry
+from zabbixcaps import ZabbixCapabilities
+from zabbixdb import ZabbixDBSnapshot
+from zabbixldaplog import USER_LOGGER, SyncStats
+from zabbixldapprofile import NullProfiler
+from zabbixstream import ZabbixStream
+
+MEDIA_FIELDS = ['mediaid', 'mediatypeid', 'sendto', 'active', 'severity', 'period']
+
 
 class ZabbixConn(object):
     """
@@ -15,11 +28,15 @@ class ZabbixConn(object):
 
     """
 
-    def __init__(self, config, ldap_conn):
+    def __init__(self, config, ldap_conn, profiler=None):
         self.ldap_conn = ldap_conn
+        self.profiler = profiler or NullProfiler()
         self.server = config.zbx_server
         self.username = config.zbx_username
         self.password = config.zbx_password
+        self.token = config.zbx_token
+        self.session_cache = config.zbx_sessioncache
+        self.cache = FileCache(config.cache_dir)
         self.auth = config.zbx_auth
         self.dryrun = config.zbx_dryrun
         self.nocheckcertificate = config.zbx_nocheckcertificate
@@ -28,39 +45,45 @@ class ZabbixConn(object):
         self.media_opt = config.media_opt
         self.media_description = config.media_description
         self.user_opt = config.user_opt
+        self.deleteorphans = config.zbx_deleteorphans
+        self.registry = UserRegistry()
+        self.userids = {}
+        self.mediatypes = {}
+        self.user_medias = {}
+        self.user_usrgrps = {}
+
+        if config.zbxdb_driver:
+            self.snapshot = ZabbixDBSnapshot(config)
+        else:
+            self.snapshot = None
         if self.nocheckcertificate:
             from requests.packages.urllib3 import disable_warnings
             disable_warnings()
 
         if config.ldap_wildcard_search:
-            self.ldap_groups = ldap_conn.get_groups_with_wildcard()
-
-        # Use logger to log information
-        self.logger = logging.getLogger()
-        if config.verbose:
-            self.logger.setLevel(logging.DEBUG)
+            self.ldap_groups = ldap_conn.get_groups_with_wildcard(self.ldap_groups)
+
+        if config.shard_count > 1:
+            self.ldap_groups = select_shard(self.ldap_groups, config.shard_index, config.shard_count)
+            self.lease_time = config.shard_leasetime
+            self.locks = LeaseLock(config.shard_lockdir,
+                                   worker_id(config.shard_index, config.shard_count),
+                                   self.lease_time)
         else:
-            self.logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-        # Log to stdout
-        ch = logging.StreamHandler()
-        if config.verbose:
-            ch.setLevel(logging.DEBUG)
+            self.locks = None
 
-        ch.setFormatter(formatter)
-        self.logger.addHandler(ch)  # Use logger to log information
-
-        # Log from pyzabbix
-        log = logging.getLogger('pyzabbix')
-        log.addHandler(ch)
-        if config.verbose:
-            log.setLevel(logging.DEBUG)
+        self.logger = logging.getLogger()
+        self.user_logger = logging.getLogger(USER_LOGGER)
+        self.stats = SyncStats()
 
     def connect(self):
         """
         Establishes a connection to the Zabbix server
 
+        An API token is used as is. Otherwise a session id left by an
+        earlier run is reused if it is still valid, and a new session is
+        only created through user.login when it is not.
+
         Raises:
             SystemExit
 
@@ -73,17 +96,84 @@ class ZabbixConn(object):
             self.conn.session.auth = (self.username, self.password)
 
         else:
-            raise SystemExit('api auth method not implemented: %s' % self.conn.auth)
+            raise SystemExit('api auth method not implemented: %s' % self.auth)
 
         if self.nocheckcertificate:
             self.conn.session.verify = False
 
+        self.stream = ZabbixStream(self.conn)
+
         try:
-            self.conn.login(self.username, self.password)
+            if self.token:
+                self.caps = ZabbixCapabilities(self.conn.api_version())
+                if self.caps.auth_header:
+                    self.conn.session.headers['Authorization'] = 'Bearer %s' % self.token
+                else:
+                    self.conn.auth = self.token
+            elif not self.resume_session():
+                self.caps = ZabbixCapabilities(self.conn.api_version())
+                self.conn.login(self.username, self.password)
+                if self.session_cache:
+                    self.cache.set(self.session_key(), {'sessionid': self.conn.auth, 'version': self.caps.version})
         except ZabbixAPIException as e:
             raise SystemExit('Cannot login to Zabbix server: %s' % e)
 
-        self.logger.info("Connected to Zabbix API Version %s" % self.conn.api_version())
+        # User types were replaced by roles, user.create rejects the type
+        if self.caps.user_roles and any(k == 'type' for k, v in self.user_opt):
+            self.logger.warning('Ignoring [user] type, Zabbix %s assigns roles with roleid instead' % self.caps)
+            self.user_opt = [(k, v) for k, v in self.user_opt if k != 'type']
+
+        if self.snapshot:
+            self.snapshot.load(self.caps)
+
+        self.logger.info("Connected to Zabbix API Version %s" % self.caps)
+
+    def disconnect(self):
+        """
+        Closes the Zabbix session, unless it is kept for the next run
+
+        """
+        if self.token or self.session_cache:
+            return
+
+        self.conn.user.logout()
+
+    def session_key(self):
+        """
+        Returns the cache key of the Zabbix session
+
+        """
+        return 'session:%s:%s' % (self.server, self.username)
+
+    def resume_session(self):
+        """
+        Reuses a Zabbix session stored by an earlier run
+
+        Returns:
+            True if the stored session is still valid, False otherwise
+
+        """
+        if not self.session_cache:
+            return False
+
+        session = self.cache.get(self.session_key())
+        if not session:
+            return False
+
+        # user.checkAuthentication must be called without the auth parameter
+        self.conn.auth = ''
+        try:
+            self.conn.user.checkAuthentication(sessionid=session['sessionid'])
+        except ZabbixAPIException:
+            self.logger.info('Stored Zabbix session has expired')
+            self.cache.delete(self.session_key())
+            return False
+
+        self.conn.auth = session['sessionid']
+        self.caps = ZabbixCapabilities(session['version'])
+        self.logger.info('Reusing stored Zabbix session')
+
+        return True
 
     def get_users(self):
         """
@@ -93,12 +183,58 @@ class ZabbixConn(object):
             A list of the existing Zabbix users
 
         """
-        result = self.conn.user.get(output='extend')
+        if self.snapshot:
+            self.userids.update(self.snapshot.users)
+            return list(self.snapshot.users)
+
+        return self.read_users(self.stream.call('user.get', output=['userid', self.caps.username_field]))
 
-        users = [user['alias'] for user in result]
+    def read_users(self, result):
+        """
+        Keeps only the interned name and id of each user while decoding
+
+        The media and groups of the users are kept by userid when they
+        were requested.
+
+        Args:
+            result (iterable): The users returned by user.get
+
+        Returns:
+            A list of the usernames
+
+        """
+        field = self.caps.username_field
+
+        users = []
+        for user in result:
+            username = sys.intern(user[field])
+            self.userids[username] = user['userid']
+            if 'medias' in user:
+                self.user_medias[user['userid']] = user['medias']
+            if 'usrgrps' in user:
+                self.user_usrgrps[user['userid']] = [g['usrgrpid'] for g in user['usrgrps']]
+            users.append(username)
 
         return users
 
+    def get_mediatype(self, description):
+        """
+        Retrieves a media type by description
+
+        Args:
+            description (str): Zabbix media type description
+
+        Returns:
+            A dict with the mediatypeid and type of the media type or None
+
+        """
+        if description not in self.mediatypes:
+            result = self.conn.mediatype.get(output=['mediatypeid', 'type'],
+                                             filter={self.caps.mediatype_name_field: description})
+            self.mediatypes[description] = result[0] if result else None
+
+        return self.mediatypes[description]
+
     def get_mediatype_id(self, description):
         """
         Retrieves the mediatypeid by description
@@ -110,10 +246,10 @@ class ZabbixConn(object):
             The mediatypeid for specified media type description
 
         """
-        result = self.conn.mediatype.get(filter={'description': description})
+        mediatype = self.get_mediatype(description)
 
-        if result:
-            mediatypeid = result[0]['mediatypeid']
+        if mediatype:
+            mediatypeid = mediatype['mediatypeid']
         else:
             mediatypeid = None
 
@@ -130,11 +266,30 @@ class ZabbixConn(object):
             The userid of the specified user
 
         """
-        result = self.conn.user.get(output='extend')
+        if user not in self.userids:
+            self.userids[user] = self.find_user_id(user)
 
-        userid = [u['userid'] for u in result if u['alias'] == user].pop()
+        return self.userids[user]
 
-        return userid
+    def find_user_id(self, user):
+        """
+        Looks up the userid of a user on the Zabbix server
+
+        Args:
+            user (str): The Zabbix username to lookup
+
+        Returns:
+            The userid of the specified user or None if it does not exist
+
+        """
+        result = self.conn.user.get(output=['userid'], filter={self.caps.username_field: user}, limit=1)
+
+        if not result:
+            return None
+
+        self.userids[user] = result[0]['userid']
+
+        return result[0]['userid']
 
     def get_groups(self):
         """
@@ -144,7 +299,10 @@ class ZabbixConn(object):
             A dict of the existing Zabbix groups and their group ids
 
         """
-        result = self.conn.usergroup.get(status=0, output='extend')
+        if self.snapshot:
+            return [{'name': name, 'usrgrpid': groupid} for name, groupid in self.snapshot.groups.items()]
+
+        result = self.conn.usergroup.get(status=0, output=['usrgrpid', 'name'])
 
         groups = [{'name': group['name'], 'usrgrpid': group['usrgrpid']} for group in result]
 
@@ -154,6 +312,10 @@ class ZabbixConn(object):
         """
         Retrieves group members for a Zabbix group
 
+        The media and groups of the members are retrieved with the same
+        request and kept by userid, so that updating a member later does
+        not need another request.
+
         Args:
             groupid (int): The group id
 
@@ -161,11 +323,15 @@ class ZabbixConn(object):
             A list of the Zabbix users for the specified group id
 
         """
-        result = self.conn.user.get(output='extend', usrgrpids=groupid)
+        if self.snapshot:
+            return self.snapshot.get_group_members(groupid)
 
-        users = [user['alias'] for user in result]
+        params = {'selectMedias': MEDIA_FIELDS}
+        if not self.caps.usergroup_massadd:
+            params['selectUsrgrps'] = ['usrgrpid']
 
-        return users
+        return self.read_users(self.stream.call('user.get', output=['userid', self.caps.username_field],
+                                                usrgrpids=groupid, **params))
 
     def create_group(self, group):
         """
@@ -182,6 +348,9 @@ class ZabbixConn(object):
 
         groupid = result['usrgrpids'].pop()
 
+        if self.snapshot:
+            self.snapshot.add_group(group, groupid)
+
         return groupid
 
     def create_user(self, user, groupid, user_opt):
@@ -196,12 +365,20 @@ class ZabbixConn(object):
         """
         random_passwd = ''.join(random.sample(string.ascii_letters + string.digits, 32))
 
-        user_defaults = {'autologin': 0, 'type': 1, 'usrgrps': [{'usrgrpid': str(groupid)}], 'passwd': random_passwd}
+        user_defaults = {'autologin': 0, 'usrgrps': [{'usrgrpid': str(groupid)}], 'passwd': random_passwd}
+        if not self.caps.user_roles:
+            user_defaults['type'] = 1
         user_defaults.update(user_opt)
         user.update(user_defaults)
 
         result = self.conn.user.create(user)
 
+        self.userids[user[self.caps.username_field]] = result['userids'][0]
+
+        if self.snapshot:
+            self.snapshot.add_user(user[self.caps.username_field], result['userids'][0])
+            self.snapshot.add_member(groupid, result['userids'][0])
+
         return result
 
     def delete_user(self, user):
@@ -216,6 +393,11 @@ class ZabbixConn(object):
 
         result = self.conn.user.delete(userid)
 
+        del self.userids[user]
+
+        if self.snapshot:
+            self.snapshot.remove_user(user)
+
         return result
 
     def update_user(self, user, groupid):
@@ -229,9 +411,59 @@ class ZabbixConn(object):
         """
         userid = self.get_user_id(user)
 
-        result = self.conn.usergroup.massadd(usrgrpids=[str(groupid)], userids=[str(userid)])
+        if self.snapshot:
+            self.snapshot.add_member(groupid, userid)
 
-        return result
+        if self.caps.usergroup_massadd:
+            return self.conn.usergroup.massadd(usrgrpids=[str(groupid)], userids=[str(userid)])
+
+        # user.update replaces the groups of the user, keep the existing ones.
+        # Other workers may have changed them since they were retrieved.
+        usrgrpids = None if self.locks else self.user_usrgrps.get(str(userid))
+        if usrgrpids is None:
+            result = self.conn.user.get(output=['userid'], userids=userid, selectUsrgrps=['usrgrpid'])
+            usrgrpids = [g['usrgrpid'] for g in result[0]['usrgrps']]
+        usrgrpids = usrgrpids + [str(groupid)]
+        self.user_usrgrps[str(userid)] = usrgrpids
+
+        return self.conn.user.update(userid=str(userid), usrgrps=[{'usrgrpid': g} for g in usrgrpids])
+
+    def get_user_medias(self, userid):
+        """
+        Retrieves the media of a Zabbix user
+
+        Args:
+            userid (str): The userid
+
+        Returns:
+            A list of the user's media
+
+        """
+        if self.snapshot and str(userid) in self.snapshot.medias:
+            return self.snapshot.medias[str(userid)]
+
+        if str(userid) not in self.user_medias:
+            result = self.conn.user.get(output=['userid'], userids=userid, selectMedias=MEDIA_FIELDS)
+            self.user_medias[str(userid)] = result[0]['medias']
+
+        return self.user_medias[str(userid)]
+
+    def replace_user_medias(self, userid, medias):
+        """
+        Replaces all media of a Zabbix user
+
+        Args:
+            userid  (str): The userid
+            medias (list): The new media of the user
+
+        """
+        medias = [{k: v for k, v in m.items() if k != 'mediaid'} for m in medias]
+
+        if self.snapshot:
+            self.snapshot.medias[str(userid)] = medias
+        self.user_medias[str(userid)] = medias
+
+        return self.conn.user.update(**{'userid': str(userid), self.caps.media_update: medias})
 
     def update_media(self, user, description, sendto, media_opt):
         """
@@ -243,27 +475,70 @@ class ZabbixConn(object):
             sendto       (str): A string containing address, phone number, etc...
             media_opt    (dict): Media options
 
+        Returns:
+            The result of the API call, or None if the user already has
+            exactly this media or the media type does not exist
+
         """
 
         userid = self.get_user_id(user)
-        mediatypeid = self.get_mediatype_id(description)
+        mediatype = self.get_mediatype(description)
 
-        if mediatypeid:
-            media_defaults = {
-                'mediatypeid': mediatypeid,
-                'sendto': sendto,
-                'active': '0',
-                'severity': '63',
-                'period': '1-7,00:00-24:00'
-            }
-            media_defaults.update(media_opt)
+        if not mediatype:
+            return None
+
+        mediatypeid = mediatype['mediatypeid']
 
+        # Email media (type 0) take a list of addresses
+        if self.caps.sendto_list and mediatype['type'] == '0':
+            sendto = [sendto]
+
+        media_defaults = {
+            'mediatypeid': mediatypeid,
+            'sendto': sendto,
+            'active': '0',
+            'severity': '63',
+            'period': '1-7,00:00-24:00'
+        }
+        media_defaults.update(media_opt)
+
+        current = [m for m in self.get_user_medias(userid) if m['mediatypeid'] == mediatypeid]
+        if len(current) == 1 and self.media_matches(current[0], media_defaults):
+            return None
+
+        if not self.caps.media_update:
             self.delete_media_by_description(user, description)
-            result = self.conn.user.addmedia(users=[{"userid": str(userid)}], medias=media_defaults)
-        else:
-            result = None
+            # The ids of the new media are unknown, read them from the API next time
+            if self.snapshot:
+                self.snapshot.medias.pop(str(userid), None)
+            self.user_medias.pop(str(userid), None)
+            return self.conn.user.addmedia(users=[{"userid": str(userid)}], medias=media_defaults)
 
-        return result
+        medias = [m for m in self.get_user_medias(userid) if m['mediatypeid'] != mediatypeid]
+        medias.append(media_defaults)
+
+        return self.replace_user_medias(userid, medias)
+
+    def media_matches(self, media, wanted):
+        """
+        Checks whether an existing media has the wanted settings
+
+        Args:
+            media  (dict): The media returned by the API
+            wanted (dict): The media to set
+
+        Returns:
+            True if all settings of the media are equal
+
+        """
+        for key in ('mediatypeid', 'sendto', 'active', 'severity', 'period'):
+            value = wanted[key]
+            if not isinstance(value, list):
+                value = str(value)
+            if media.get(key) != value:
+                return False
+
+        return True
 
     def delete_media_by_description(self, user, description):
         """
@@ -279,13 +554,17 @@ class ZabbixConn(object):
         mediatypeid = self.get_mediatype_id(description)
 
         if mediatypeid:
-            user_full = self.conn.user.get(output="extend", userids=userid, selectMedias=["mediatypeid", "mediaid"])
-            media_ids = [int(u['mediaid']) for u in user_full[0]['medias'] if u['mediatypeid'] == mediatypeid]
-
-            if media_ids:
-                self.logger.info('Remove other exist media from user %s (type=%s)' % (user, description))
-                for id in media_ids:
-                    self.conn.user.deletemedia(id)
+            medias = self.get_user_medias(userid)
+            remove = [m for m in medias if m['mediatypeid'] == mediatypeid]
+
+            if remove:
+                self.user_logger.info('Remove other exist media from user %s (type=%s)', user, description,
+                                     extra={'fields': {'user': user, 'action': 'remove_media'}})
+                if self.caps.media_update:
+                    self.replace_user_medias(userid, [m for m in medias if m['mediatypeid'] != mediatypeid])
+                else:
+                    for m in remove:
+                        self.conn.user.deletemedia(int(m['mediaid']))
 
     def create_missing_groups(self):
         """
@@ -299,6 +578,89 @@ class ZabbixConn(object):
             if not self.dryrun:
                 grpid = self.create_group(eachGroup)
                 self.logger.info('Group %s created with groupid %s' % (eachGroup, grpid))
+            self.stats.incr('groups', 'created')
+
+    def user_lease(self, user):
+        """
+        Serializes changes of a user between sharded workers
+
+        Args:
+            user (str): The Zabbix username
+
+        Returns:
+            A context manager holding the lease of the user
+
+        """
+        if self.locks is None:
+            return contextlib.nullcontext()
+
+        return self.locks.lease('user:%s' % user, self.lease_time)
+
+    def owns_user(self, user):
+        """
+        Checks whether this worker owns a user
+
+        Users which are members of groups in different shards are owned
+        by the first worker claiming them. Only the owner updates the
+        media of a user.
+
+        Args:
+            user (str): The Zabbix username
+
+        Returns:
+            True if this worker owns the user
+
+        """
+        if self.locks is None:
+            return True
+
+        return self.locks.claim('claim:%s' % user)
+
+    def user_exists(self, user):
+        """
+        Checks that a user still exists before it is changed
+
+        With sharding, another worker may have deleted the user since the
+        users were retrieved, so the userid is looked up again. Without
+        sharding the retrieved userid is used as is.
+
+        Args:
+            user (str): The Zabbix username
+
+        Returns:
+            False if the user was deleted, it is skipped and counted
+
+        """
+        if self.locks is None:
+            return True
+
+        userid = self.find_user_id(user)
+        if userid is None:
+            self.logger.warning('User "%s" was deleted by another worker, skipping user' % user,
+                                extra={'fields': {'user': user, 'action': 'skip_deleted'}})
+            self.stats.incr('users', 'skipped_deleted')
+            self.userids.pop(user, None)
+            if self.snapshot:
+                self.snapshot.remove_user(user)
+            return False
+
+        self.userids[user] = userid
+
+        return True
+
+    def skip_locked_user(self, user):
+        """
+        Skips a user whose lease is held by another worker for too long
+
+        The user is synced again on the next run.
+
+        Args:
+            user (str): The Zabbix username
+
+        """
+        self.logger.warning('User "%s" is locked by another worker, skipping user' % user,
+                            extra={'fields': {'user': user, 'action': 'skip_locked'}})
+        self.stats.incr('users', 'skipped_locked')
 
     def convert_severity(self, severity):
 
@@ -334,85 +696,203 @@ class ZabbixConn(object):
     def sync_users(self):
         """
         Syncs Zabbix with LDAP users
+
+        Raises:
+            SystemExit
+
         """
+        if self.locks is None:
+            return self.sync_all_groups()
 
-        self.ldap_conn.connect()
-        zabbix_all_users = self.get_users()
+        # A run of the same shard which did not finish yet keeps the shard
+        if not self.locks.start():
+            raise SystemExit('Shard %s is already being synced by another process' % self.locks.worker)
 
-        for eachGroup in self.ldap_groups:
+        try:
+            self.sync_all_groups()
+        finally:
+            self.locks.stop()
 
-            ldap_users = self.ldap_conn.get_group_members(eachGroup)
+    def sync_all_groups(self):
+        """
+        Syncs the members and media of all LDAP groups
 
-            # Do nothing if LDAP group contains no users and "--delete-orphans" is not specified
-            if not ldap_users and not self.deleteorphans:
-                continue
+        """
+        with self.profiler.phase('sync_users'):
+            self.ldap_conn.connect()
+            self.ldap_conn.prefetch(self.ldap_groups)
+            zabbix_all_users = self.registry.add_users(self.get_users())
+            zabbix_groups = {g['name']: g['usrgrpid'] for g in self.get_groups()}
 
-            zabbix_grpid = [g['usrgrpid'] for g in self.get_groups() if g['name'] == eachGroup].pop()
+        for eachGroup in self.ldap_groups:
+            with self.profiler.phase('group %s' % eachGroup):
+                members = self.sync_group(eachGroup, zabbix_groups, zabbix_all_users)
 
-            zabbix_group_users = self.get_group_members(zabbix_grpid)
+            if members is None:
+                continue
 
-            missing_users = set(list(ldap_users.keys())) - set(zabbix_group_users)
+            with self.profiler.phase('media %s' % eachGroup):
+                self.sync_group_media(eachGroup, zabbix_groups[eachGroup], *members)
 
-            # Add missing users
-            for eachUser in missing_users:
+        self.ldap_conn.disconnect()
 
-                # Create new user if it does not exists already
-                if eachUser not in zabbix_all_users:
-                    self.logger.info('Creating user "%s", member of Zabbix group "%s"' % (eachUser, eachGroup))
-                    user = {'alias': eachUser}
-                    user['name'] = self.ldap_conn.get_user_givenName(ldap_users[eachUser]).decode('utf8')
-                    user['surname'] = self.ldap_conn.get_user_sn(ldap_users[eachUser]).decode('utf8')
+    def sync_group(self, eachGroup, zabbix_groups, zabbix_all_users):
+        """
+        Syncs the members of a Zabbix group with an LDAP group
 
-                    if user['name'] is None:
-                        user['name'] = ''
-                    if user['surname'] is None:
-                        user['surname'] = ''
+        Args:
+            eachGroup         (str): The group name
+            zabbix_groups    (dict): The ids of the Zabbix groups by name
+            zabbix_all_users  (set): The ids of the existing Zabbix users
 
-                    self.create_user(user, zabbix_grpid, self.user_opt)
-                    zabbix_all_users.append(eachUser)
-                else:
-                    # Update existing user to be member of the group
-                    self.logger.info('Updating user "%s", adding to group "%s"' % (eachUser, eachGroup))
-                    self.update_user(eachUser, zabbix_grpid)
-
-            # Handle any extra users in the groups
-            extra_users = set(zabbix_group_users) - set(list(ldap_users.keys()))
-            if extra_users:
-                self.logger.info('Users in group %s which are not found in LDAP group:' % eachGroup)
-
-                for eachUser in extra_users:
-                    if self.deleteorphans:
-                        self.logger.info('Deleting user: "%s"' % eachUser)
-                        if not self.dryrun:
-                            self.delete_user(eachUser)
+        Returns:
+            A tuple of the ids of the LDAP group members and of the users
+            added to the group, or None if the group was skipped
+
+        """
+        registry = self.registry
+
+        ldap_users = self.ldap_conn.get_group_members(eachGroup)
+
+        # A group missing from LDAP is not an empty group, never delete its Zabbix members
+        if ldap_users is None:
+            self.stats.incr('groups', 'not_found')
+            return None
+
+        # Do nothing if LDAP group contains no users and "--delete-orphans" is not specified
+        if not ldap_users and not self.deleteorphans:
+            return None
+
+        ldap_group_users = registry.add_group_members(ldap_users)
+        del ldap_users
+
+        zabbix_grpid = zabbix_groups[eachGroup]
+
+        zabbix_group_users = registry.add_users(self.get_group_members(zabbix_grpid))
+
+        missing_users = ldap_group_users - zabbix_group_users
+        self.stats.incr('groups', 'synced')
+
+        # Add missing users
+        skipped_users = set()
+        for userid in missing_users:
+            record = registry.get(userid)
+            eachUser = record.username
+
+            try:
+                with self.user_lease(eachUser):
+                    # Another worker may have created the user in the meantime
+                    if userid not in zabbix_all_users and self.locks and self.find_user_id(eachUser):
+                        zabbix_all_users.add(userid)
+
+                    # Create new user if it does not exists already
+                    if userid not in zabbix_all_users:
+                        self.user_logger.info('Creating user "%s", member of Zabbix group "%s"', eachUser, eachGroup,
+                                             extra={'fields': {'user': eachUser, 'group': eachGroup, 'action': 'create'}})
+                        attributes = self.ldap_conn.get_user_attributes(record.dn, ['givenName', 'sn'])
+                        user = {self.caps.username_field: eachUser}
+                        user['name'] = attributes['givenName'] or ''
+                        user['surname'] = attributes['sn'] or ''
+
+                        self.create_user(user, zabbix_grpid, self.user_opt)
+                        zabbix_all_users.add(userid)
+                        self.stats.incr('users', 'created')
+                    elif not self.user_exists(eachUser):
+                        zabbix_all_users.discard(userid)
+                        skipped_users.add(userid)
                     else:
-                        self.logger.info(' * %s' % eachUser)
-
-            # update users media
-            onlycreate = False
-            media_opt_filtered = []
-            for elem in self.media_opt:
-                if elem[0] == "onlycreate" and elem[1].lower() == "true":
-                    onlycreate = True
-                if elem[0] == "severity":
-                    media_opt_filtered.append(
-                        (elem[0], self.convert_severity(elem[1]))
-                    )
+                        # Update existing user to be member of the group
+                        self.user_logger.info('Updating user "%s", adding to group "%s"', eachUser, eachGroup,
+                                             extra={'fields': {'user': eachUser, 'group': eachGroup, 'action': 'add_to_group'}})
+                        self.update_user(eachUser, zabbix_grpid)
+                        self.stats.incr('users', 'added_to_group')
+            except LeaseTimeout:
+                self.skip_locked_user(eachUser)
+                skipped_users.add(userid)
+
+        missing_users = missing_users - skipped_users
+
+        # Handle any extra users in the groups
+        extra_users = zabbix_group_users - ldap_group_users
+        if extra_users:
+            self.logger.info('Users in group %s which are not found in LDAP group:' % eachGroup)
+
+            for eachUser in registry.usernames(extra_users):
+                if self.deleteorphans:
+                    self.user_logger.info('Deleting user: "%s"', eachUser,
+                                         extra={'fields': {'user': eachUser, 'group': eachGroup, 'action': 'delete'}})
+                    if not self.dryrun:
+                        try:
+                            with self.user_lease(eachUser):
+                                if not self.user_exists(eachUser):
+                                    continue
+                                self.delete_user(eachUser)
+                        except LeaseTimeout:
+                            self.skip_locked_user(eachUser)
+                            continue
+                    self.stats.incr('users', 'deleted')
                 else:
-                    media_opt_filtered.append(elem)
+                    self.user_logger.info(' * %s', eachUser,
+                                         extra={'fields': {'user': eachUser, 'group': eachGroup, 'action': 'orphaned'}})
+                    self.stats.incr('users', 'orphaned')
 
-            if onlycreate:
-                self.logger.info("Add media only on newly created users for group >>>%s<<<" % eachGroup)
-                zabbix_group_users = missing_users
+        return ldap_group_users, missing_users
+
+    def sync_group_media(self, eachGroup, zabbix_grpid, ldap_group_users, missing_users):
+        """
+        Updates the media of the members of a Zabbix group
+
+        Args:
+            eachGroup         (str): The group name
+            zabbix_grpid      (str): The id of the Zabbix group
+            ldap_group_users  (set): The ids of the LDAP group members
+            missing_users     (set): The ids of the users added to the group
+
+        """
+        registry = self.registry
+
+        # update users media
+        onlycreate = False
+        media_opt_filtered = []
+        for elem in self.media_opt:
+            if elem[0] == "onlycreate" and elem[1].lower() == "true":
+                onlycreate = True
+            if elem[0] == "severity":
+                media_opt_filtered.append(
+                    (elem[0], self.convert_severity(elem[1]))
+                )
             else:
-                self.logger.info("Update media on all users for group >>>%s<<<" % eachGroup)
-                zabbix_group_users = self.get_group_members(zabbix_grpid)
+                media_opt_filtered.append(elem)
 
-            for eachUser in set(zabbix_group_users):
-                self.logger.info('>>> Updating/create user media for "%s", update "%s"' % (eachUser, self.media_description))
-                sendto = self.ldap_conn.get_user_media(ldap_users[eachUser], self.ldap_media).decode("utf8")
+        if onlycreate:
+            self.logger.info("Add media only on newly created users for group >>>%s<<<" % eachGroup)
+            media_users = missing_users
+        else:
+            self.logger.info("Update media on all users for group >>>%s<<<" % eachGroup)
+            media_users = registry.add_users(self.get_group_members(zabbix_grpid))
 
-                if sendto and not self.dryrun:
-                    self.update_media(eachUser, self.media_description, sendto, media_opt_filtered)
+        # Media can only be looked up for users found in the LDAP group
+        for userid in media_users & ldap_group_users:
+            record = registry.get(userid)
 
-        self.ldap_conn.disconnect()
+            if not self.owns_user(record.username):
+                self.stats.incr('media', 'skipped_other_worker')
+                continue
+
+            self.user_logger.info('>>> Updating/create user media for "%s", update "%s"', record.username, self.media_description,
+                                 extra={'fields': {'user': record.username, 'group': eachGroup, 'action': 'update_media'}})
+            sendto = self.ldap_conn.get_user_attributes(record.dn, [self.ldap_media])[self.ldap_media]
+
+            if sendto and not self.dryrun:
+                try:
+                    with self.user_lease(record.username):
+                        if not self.user_exists(record.username):
+                            continue
+                        result = self.update_media(record.username, self.media_description, sendto, media_opt_filtered)
+                except LeaseTimeout:
+                    self.skip_locked_user(record.username)
+                    continue
+                if result is None:
+                    self.stats.incr('media', 'unchanged')
+                else:
+                    self.stats.incr('media', 'updated')
@@ -0,0 +1,147 @@
+import importlib
+import logging
+
+
+class ZabbixDBSnapshot(object):
+    """
+    Zabbix database snapshot class
+
+    Loads the current Zabbix users, groups, group members and media with a
+    few read-only queries against the Zabbix database (or a replica).
+    All changes are still made through the Zabbix API, and mirrored in
+    the snapshot by the caller.
+
+    Any DB-API 2.0 driver can be used, e.g. psycopg2, pymysql or sqlite3.
+
+    """
+
+    def __init__(self, config):
+        self.driver = config.zbxdb_driver
+        self.params = dict(config.zbxdb_params)
+        if 'port' in self.params:
+            self.params['port'] = int(self.params['port'])
+
+        self.logger = logging.getLogger()
+
+        self.users = {}
+        self.usernames = {}
+        self.groups = {}
+        self.members = {}
+        self.medias = {}
+
+    def connect(self):
+        """
+        Establishes a connection to the Zabbix database
+
+        Raises:
+            SystemExit
+
+        """
+        try:
+            module = importlib.import_module(self.driver)
+        except ImportError:
+            raise SystemExit('Database driver "%s" is not installed' % self.driver)
+
+        try:
+            return module.connect(**self.params)
+        except module.Error as e:
+            raise SystemExit('Cannot connect to Zabbix database: %s' % e)
+
+    def load(self, caps):
+        """
+        Loads the snapshot
+
+        Args:
+            caps (ZabbixCapabilities): Capabilities of the Zabbix server
+
+        """
+        conn = self.connect()
+
+        try:
+            cursor = conn.cursor()
+
+            # The users.alias column was renamed together with the API field
+            cursor.execute('SELECT userid, %s FROM users' % caps.username_field)
+            for userid, username in cursor.fetchall():
+                self.users[username] = str(userid)
+                self.usernames[str(userid)] = username
+                self.medias[str(userid)] = []
+
+            cursor.execute('SELECT usrgrpid, name FROM usrgrp WHERE users_status = 0')
+            for usrgrpid, name in cursor.fetchall():
+                self.groups[name] = str(usrgrpid)
+                self.members[str(usrgrpid)] = set()
+
+            cursor.execute('SELECT usrgrpid, userid FROM users_groups')
+            for usrgrpid, userid in cursor.fetchall():
+                if str(usrgrpid) in self.members:
+                    self.members[str(usrgrpid)].add(str(userid))
+
+            cursor.execute('SELECT m.mediaid, m.userid, m.mediatypeid, m.sendto, m.active, m.severity, m.period, mt.type '
+                           'FROM media m JOIN media_type mt ON mt.mediatypeid = m.mediatypeid')
+            for mediaid, userid, mediatypeid, sendto, active, severity, period, type in cursor.fetchall():
+                # The API returns the addresses of email media as a list
+                if caps.sendto_list and str(type) == '0':
+                    sendto = sendto.split('\n')
+                self.medias.setdefault(str(userid), []).append({
+                    'mediaid': str(mediaid),
+                    'mediatypeid': str(mediatypeid),
+                    'sendto': sendto,
+                    'active': str(active),
+                    'severity': str(severity),
+                    'period': period,
+                })
+
+            cursor.close()
+        finally:
+            conn.close()
+
+        self.logger.info('Loaded %d users and %d groups from the Zabbix database' % (len(self.users), len(self.groups)))
+
+    def get_group_members(self, groupid):
+        """
+        Retrieves the members of a group
+
+        Args:
+            groupid (str): The group id
+
+        Returns:
+            A list of usernames
+
+        """
+        return [self.usernames[u] for u in self.members.get(str(groupid), ()) if u in self.usernames]
+
+    def add_group(self, name, groupid):
+        """
+        Records a newly created group
+
+        """
+        self.groups[name] = str(groupid)
+        self.members[str(groupid)] = set()
+
+    def add_user(self, username, userid):
+        """
+        Records a newly created user
+
+        """
+        self.users[username] = str(userid)
+        self.usernames[str(userid)] = username
+        self.medias[str(userid)] = []
+
+    def add_member(self, groupid, userid):
+        """
+        Records a user added to a group
+
+        """
+        self.members.setdefault(str(groupid), set()).add(str(userid))
+
+    def remove_user(self, username):
+        """
+        Records a deleted user
+
+        """
+        userid = self.users.pop(username, None)
+        self.usernames.pop(userid, None)
+        self.medias.pop(userid, None)
+        for members in self.members.values():
+            members.discard(userid)
@@ -3,6 +3,58 @@ import sys
 import traceback
 
 
+class LDAPSourceConf(object):
+    """
+    Configuration of one of several LDAP sources
+
+    Read from an [ldap:<name>] section. Options missing from the section
+    are taken from the [ldap], [ad] and [openldap] sections, and all other
+    settings (command-line flags, cache, ...) from the main configuration.
+
+    """
+
+    def __init__(self, parser, section, config, precedence):
+        self.parent = config
+        self.name = section.split(':', 1)[1]
+
+        def get(option, fallback):
+            return parser.get(section, option, fallback=fallback, raw=True)
+
+        self.ldap_type = get('type', config.ldap_type)
+        self.ldap_uri = get('uri', config.ldap_uri)
+        self.ldap_base = get('base', config.ldap_base)
+        self.ldap_user = get('binduser', config.ldap_user)
+        self.ldap_passwd = get('bindpass', config.ldap_passwd)
+        self.ldap_page_size = parser.getint(section, 'pagesize', fallback=config.ldap_page_size)
+
+        if not self.ldap_uri or not self.ldap_base:
+            raise ValueError('LDAP source %s has no uri or base' % self.name)
+
+        # Lower values win when a username exists in several sources
+        self.precedence = parser.getint(section, 'precedence', fallback=precedence)
+
+        if self.ldap_type == 'activedirectory':
+            self.ldap_active_directory = True
+            self.ldap_group_filter = get('filtergroup', config.ad_filtergroup)
+            self.ldap_user_filter = get('filteruser', config.ad_filteruser)
+            self.ldap_disabled_filter = get('filterdisabled', config.ad_filterdisabled)
+            self.ldap_memberof_filter = get('filtermemberof', config.ad_filtermemberof)
+            self.ldap_group_member_attribute = get('groupattribute', config.ad_groupattribute)
+            self.ldap_uid_attribute = get('userattribute', config.ad_userattribute)
+            self.ldap_group_name_attribute = get('groupnameattribute', config.ad_groupnameattribute)
+        else:
+            self.ldap_active_directory = None
+            self.openldap_type = get('openldaptype', config.openldap_type)
+            self.ldap_group_filter = get('filtergroup', config.openldap_filtergroup)
+            self.ldap_user_filter = get('filteruser', config.openldap_filteruser)
+            self.ldap_group_member_attribute = get('groupattribute', config.openldap_groupattribute)
+            self.ldap_uid_attribute = get('userattribute', config.openldap_userattribute)
+            self.ldap_group_name_attribute = get('groupnameattribute', config.openldap_groupnameattribute)
+
+    def __getattr__(self, name):
+        return getattr(self.parent, name)
+
+
 class ZabbixLDAPConf(object):
     """
     Zabbix-LDAP configuration class
@@ -11,7 +63,7 @@ class ZabbixLDAPConf(object):
 
     """
 
-    def __init__(self, config):
+    def __init__(self, config, from_snapshot=False):
         self.config = config
 
         parser = configparser.ConfigParser()
@@ -29,19 +81,31 @@ class ZabbixLDAPConf(object):
         self.zbx_nocheckcertificate = False
         self.zbx_recursivezbx_recursive = False
 
+        self.shard_index = 0
+        self.shard_count = 1
+
 
         try:
             self.ldap_type = self.try_get_item(parser, 'ldap', 'type', None)
 
-            self.ldap_uri = parser.get('ldap', 'uri')
-            self.ldap_base = parser.get('ldap', 'base')
-
             self.ldap_groups = [i.strip() for i in parser.get('ldap', 'groups').split(',')]
 
-            self.ldap_user = parser.get('ldap', 'binduser')
-            self.ldap_passwd = parser.get('ldap', 'bindpass')
+            # With [ldap:<name>] source sections, [ldap] only holds defaults for the sources.
+            # No LDAP server is needed when syncing from a snapshot.
+            ldap_source_sections = [i for i in parser.sections() if i.startswith('ldap:')]
+            if ldap_source_sections or from_snapshot:
+                self.ldap_uri = self.try_get_item(parser, 'ldap', 'uri', None)
+                self.ldap_base = self.try_get_item(parser, 'ldap', 'base', None)
+                self.ldap_user = self.try_get_item(parser, 'ldap', 'binduser', None)
+                self.ldap_passwd = self.try_get_item(parser, 'ldap', 'bindpass', None)
+            else:
+                self.ldap_uri = parser.get('ldap', 'uri')
+                self.ldap_base = parser.get('ldap', 'base')
+                self.ldap_user = parser.get('ldap', 'binduser')
+                self.ldap_passwd = parser.get('ldap', 'bindpass')
 
             self.ldap_media = self.try_get_item(parser, 'ldap', 'media', 'mail')
+            self.ldap_page_size = parser.getint('ldap', 'pagesize', fallback=500)
 
             self.ad_filtergroup = parser.get('ad', 'filtergroup', fallback='(&(objectClass=group)(name=%s))', raw=True)
             self.ad_filteruser = parser.get('ad', 'filteruser', fallback='(objectClass=user)(objectCategory=Person))',
@@ -52,6 +116,7 @@ class ZabbixLDAPConf(object):
                                                 fallback='(memberOf:1.2.840.113556.1.4.1941:=%s)', raw=True)
             self.ad_groupattribute = parser.get('ad', 'groupattribute', fallback='member', raw=True)
             self.ad_userattribute = parser.get('ad', 'userattribute', fallback='sAMAccountName', raw=True)
+            self.ad_groupnameattribute = parser.get('ad', 'groupnameattribute', fallback='name', raw=True)
 
             self.openldap_type = parser.get('openldap', 'type', fallback='posixgroup')
             self.openldap_filtergroup = parser.get('openldap', 'filtergroup',
@@ -60,14 +125,34 @@ class ZabbixLDAPConf(object):
                                                   fallback='(&(objectClass=posixAccount)(uid=%s))', raw=True)
             self.openldap_groupattribute = parser.get('openldap', 'groupattribute', fallback='memberUid', raw=True)
             self.openldap_userattribute = parser.get('openldap', 'userattribute', fallback='uid', raw=True)
+            self.openldap_groupnameattribute = parser.get('openldap', 'groupnameattribute', fallback='cn', raw=True)
 
             self.zbx_server = parser.get('zabbix', 'server')
-            self.zbx_username = parser.get('zabbix', 'username')
-            self.zbx_password = parser.get('zabbix', 'password')
+            self.zbx_token = self.try_get_item(parser, 'zabbix', 'token', None)
+            if self.zbx_token:
+                self.zbx_username = self.try_get_item(parser, 'zabbix', 'username', None)
+                self.zbx_password = self.try_get_item(parser, 'zabbix', 'password', None)
+            else:
+                self.zbx_username = parser.get('zabbix', 'username')
+                self.zbx_password = parser.get('zabbix', 'password')
+            self.zbx_sessioncache = parser.getboolean('zabbix', 'sessioncache', fallback=True)
             self.zbx_auth = parser.get('zabbix', 'auth')
 
+            self.zbxdb_driver = self.try_get_item(parser, 'zabbixdb', 'driver', None)
+            self.zbxdb_params = self.remove_config_section_items(self.try_get_section(parser, 'zabbixdb', []),
+                                                                 ('driver',))
+
             self.user_opt = self.try_get_section(parser, 'user', {})
 
+            self.cache_dir = parser.get('cache', 'dir', fallback='~/.cache/zabbix-ldap-sync')
+            self.cache_groups_ttl = parser.getint('cache', 'groups_ttl', fallback=0)
+
+            self.shard_lockdir = parser.get('sharding', 'lockdir', fallback='~/.cache/zabbix-ldap-sync/locks')
+            self.shard_leasetime = parser.getint('sharding', 'leasetime', fallback=300)
+
+            self.log_format = parser.get('logging', 'format', fallback='text')
+            self.log_peruser = parser.getboolean('logging', 'peruser', fallback=True)
+
             self.media_description = self.try_get_item(parser, 'media', 'description', 'Email')
             self.media_opt = self.remove_config_section_items(self.try_get_section(parser, 'media', {}),
                                                               ('description', 'userid'))
@@ -80,6 +165,7 @@ class ZabbixLDAPConf(object):
                 self.ldap_memberof_filter = self.ad_filtermemberof
                 self.ldap_group_member_attribute = self.ad_groupattribute
                 self.ldap_uid_attribute = self.ad_userattribute
+                self.ldap_group_name_attribute = self.ad_groupnameattribute
             else:
                 self.ldap_recursive = False
                 self.ldap_active_directory = None
@@ -88,6 +174,10 @@ class ZabbixLDAPConf(object):
                 self.ldap_user_filter = self.openldap_filteruser
                 self.ldap_group_member_attribute = self.openldap_groupattribute
                 self.ldap_uid_attribute = self.openldap_userattribute
+                self.ldap_group_name_attribute = self.openldap_groupnameattribute
+
+            self.ldap_sources = [LDAPSourceConf(parser, section, self, precedence)
+                                 for precedence, section in enumerate(ldap_source_sections)]
 
         except Exception as e:
             print(e)
@@ -0,0 +1,140 @@
+import collections
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+
+# Logger used for the per-user lines emitted by the sync loop
+USER_LOGGER = 'zabbix-ldap-sync.users'
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Log formatter emitting one JSON object per line
+
+    Structured values passed as ``extra={'fields': {...}}`` are merged
+    into the emitted object.
+
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, sort_keys=True)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler passing the exception of a record on to the listener
+
+    The stock handler formats the record before queueing it and drops
+    ``exc_info``, so the traceback ends up in the message and the
+    formatter of the listener cannot emit it separately.
+
+    """
+
+    def prepare(self, record):
+        # Merge the arguments now, they may change before the record is written
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class SyncStats(object):
+    """
+    Per-phase summary counters
+
+    Keeps the totals of a sync run, so the per-user log lines can be
+    switched off without losing track of what has been done.
+
+    """
+
+    def __init__(self):
+        self.counters = collections.OrderedDict()
+
+    def incr(self, phase, counter, count=1):
+        """
+        Increments a counter
+
+        Args:
+            phase   (str): Name of the sync phase
+            counter (str): Name of the counter
+            count   (int): Value to add
+
+        """
+        self.counters.setdefault(phase, collections.Counter())[counter] += count
+
+    def log_summary(self, logger):
+        """
+        Logs one summary line per phase
+
+        Args:
+            logger (Logger): Logger to write the summary to
+
+        """
+        for phase, counter in self.counters.items():
+            totals = ', '.join('%s=%d' % (name, count) for name, count in sorted(counter.items()))
+            logger.info('Summary for %s: %s', phase, totals,
+                        extra={'fields': {'phase': phase, 'counters': dict(counter)}})
+
+
+def setup_logging(config):
+    """
+    Configures logging for the whole process
+
+    Records are put on a queue by the logging calls and written to stdout
+    by a background thread, so formatting and I/O stay off the sync loop.
+
+    Args:
+        config (ZabbixLDAPConf): The configuration
+
+    Returns:
+        The started QueueListener, which has to be stopped on exit
+
+    """
+    level = logging.DEBUG if config.verbose else logging.INFO
+
+    if config.log_format == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    # Log to stdout
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(QueueHandler(log_queue))
+
+    if not config.log_peruser:
+        logging.getLogger(USER_LOGGER).setLevel(logging.WARNING)
+
+    # Log from pyzabbix and pyldap
+    if config.verbose:
+        logging.getLogger('pyzabbix').setLevel(logging.DEBUG)
+        logging.getLogger('ldap').setLevel(logging.DEBUG)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+
+    return listener
@@ -0,0 +1,154 @@
+import contextlib
+import cProfile
+import os
+import pstats
+import re
+import tracemalloc
+
+# Files whose allocations are made by the profiler itself
+PROFILER_FILES = frozenset([tracemalloc.__file__, cProfile.__file__, pstats.__file__, __file__])
+
+
+class NullProfiler(object):
+    """
+    Profiler used when profiling is disabled
+
+    """
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def close(self):
+        pass
+
+
+class PhaseProfiler(object):
+    """
+    Profiles the phases of a sync run
+
+    For each phase the following files are written to the output
+    directory, prefixed with a sequence number and the phase name:
+
+    * ``.pstats`` - cProfile statistics, readable with the pstats module
+    * ``.alloc.txt`` - top memory allocations of the phase (tracemalloc)
+    * ``.folded`` - collapsed stacks, usable with flamegraph.pl or speedscope
+
+    Phases must not be nested.
+
+    """
+
+    def __init__(self, directory, top=25):
+        self.directory = directory
+        self.top = top
+        self.count = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        tracemalloc.start(25)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Profiles the with block as one phase
+
+        Args:
+            name (str): Name of the phase
+
+        """
+        self.count += 1
+        basename = os.path.join(self.directory, '%03d-%s' % (self.count, re.sub(r'[^\w.-]+', '_', name)))
+
+        profile = cProfile.Profile()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+
+            profile.dump_stats(basename + '.pstats')
+            self.write_allocations(basename + '.alloc.txt', name, before, after)
+            self.write_collapsed(basename + '.folded', pstats.Stats(profile))
+
+    def write_allocations(self, path, name, before, after):
+        """
+        Writes the top allocations made during a phase
+
+        Args:
+            path          (str): Output file
+            name          (str): Name of the phase
+            before   (Snapshot): tracemalloc snapshot taken at the start
+            after    (Snapshot): tracemalloc snapshot taken at the end
+
+        """
+        current, peak = tracemalloc.get_traced_memory()
+
+        with open(path, 'w') as f:
+            f.write('Phase: %s\n' % name)
+            f.write('Traced memory: current %d KiB, peak %d KiB\n\n' % (current // 1024, peak // 1024))
+            # Grouped by line, every statistic has a single frame. Dropping the
+            # profiler's lines here is much faster than Snapshot.filter_traces.
+            stats = [s for s in after.compare_to(before, 'lineno') if s.traceback[0].filename not in PROFILER_FILES]
+            for stat in stats[:self.top]:
+                f.write('%s\n' % stat)
+
+    def write_collapsed(self, path, stats, max_depth=64):
+        """
+        Writes the profile as collapsed stacks
+
+        cProfile only records caller/callee pairs, so the time of a
+        function called from several places is split between the stacks
+        in proportion to the time spent from each caller.
+
+        Args:
+            path           (str): Output file
+            stats   (pstats.Stats): The profile statistics
+            max_depth      (int): Maximum stack depth
+
+        """
+        entries = stats.stats
+        callees = {}
+        for func, (cc, nc, tt, ct, callers) in entries.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+
+        lines = []
+
+        def label(func):
+            filename, line, funcname = func
+            return ('%s:%d:%s' % (os.path.basename(filename), line, funcname)).replace(';', ':')
+
+        def walk(func, stack, fraction):
+            cc, nc, tt, ct, callers = entries[func]
+            stack = stack + [label(func)]
+
+            usec = int(tt * fraction * 1000000)
+            if usec > 0:
+                lines.append('%s %d' % (';'.join(stack), usec))
+
+            if len(stack) >= max_depth:
+                return
+
+            for callee, edge_time in callees.get(func, []):
+                callee_time = entries[callee][3]
+                # Skip recursion and paths below the output resolution
+                if callee_time <= 0 or edge_time * fraction < 0.000001 or label(callee) in stack:
+                    continue
+                walk(callee, stack, fraction * edge_time / callee_time)
+
+        for func, (cc, nc, tt, ct, callers) in entries.items():
+            if not callers:
+                walk(func, [], 1.0)
+
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+    def close(self):
+        """
+        Stops tracing memory allocations
+
+        """
+        tracemalloc.stop()
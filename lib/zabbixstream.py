@@ -0,0 +1,165 @@
+import codecs
+import json
+import re
+
+from pyzabbix import ZabbixAPIException
+
+RESULT_ARRAY = re.compile(r'"result"\s*:\s*\[')
+WHITESPACE = re.compile(r'[\s,]*')
+SEPARATOR = re.compile(r'\s*[,\]]')
+
+
+def iter_result(chunks):
+    """
+    Decodes the items of a JSON-RPC result array incrementally
+
+    Only the text of the item being decoded is kept in memory, not the
+    whole response. Responses without a result array (errors, scalar
+    results) are decoded as a whole.
+
+    Args:
+        chunks (iterable): The response body as chunks of bytes
+
+    Yields:
+        The items of the result array
+
+    Raises:
+        ZabbixAPIException
+
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf8')()
+    chunks = iter(chunks)
+    buf = ''
+
+    # Find the start of the result array
+    while True:
+        match = RESULT_ARRAY.search(buf)
+        if match:
+            buf = buf[match.end():]
+            break
+
+        if '"error"' in buf:
+            buf += ''.join(utf8.decode(c) for c in chunks)
+            yield from decode_response(buf + utf8.decode(b'', final=True))
+            return
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            yield from decode_response(buf + utf8.decode(b'', final=True))
+            return
+
+        buf += utf8.decode(chunk)
+
+    pos = 0
+    ended = False
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+
+        if pos < len(buf):
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                pass
+            else:
+                # A number may go on in the next chunk, so an item is only
+                # complete when a separator follows it
+                if SEPARATOR.match(buf, end) or ended:
+                    yield item
+                    pos = end
+                    continue
+
+        if ended:
+            raise ZabbixAPIException('Truncated response from Zabbix API')
+
+        # The next item is incomplete, read more data
+        chunk = next(chunks, None)
+        if chunk is None:
+            ended = True
+            buf = buf[pos:] + utf8.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+
+
+def decode_response(text):
+    """
+    Decodes a complete JSON-RPC response
+
+    Args:
+        text (str): The response body
+
+    Yields:
+        The items of the result, or the result itself if it is no list
+
+    Raises:
+        ZabbixAPIException
+
+    """
+    try:
+        response = json.loads(text)
+    except ValueError:
+        raise ZabbixAPIException('Unable to parse response from Zabbix API: %.200s' % text)
+
+    if 'error' in response:
+        error = response['error']
+        raise ZabbixAPIException('Error %s: %s, %s' % (error['code'], error['message'], error['data']), error['code'])
+
+    result = response.get('result')
+    if isinstance(result, list):
+        yield from result
+    else:
+        yield result
+
+
+class ZabbixStream(object):
+    """
+    Streaming Zabbix API client
+
+    Issues JSON-RPC requests through the session of a pyzabbix ZabbixAPI
+    object, and decodes large result arrays incrementally while the
+    response is received. requests asks for a compressed response and
+    decompresses it while streaming.
+
+    """
+
+    def __init__(self, zapi, chunk_size=65536):
+        self.zapi = zapi
+        self.chunk_size = chunk_size
+
+    def call(self, method, **params):
+        """
+        Calls an API method
+
+        Args:
+            method   (str): The API method, e.g. 'user.get'
+            params        : The method parameters
+
+        Yields:
+            The items of the result array
+
+        Raises:
+            ZabbixAPIException
+
+        """
+        request = {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params,
+            'id': self.zapi.id,
+        }
+        if self.zapi.auth:
+            request['auth'] = self.zapi.auth
+
+        response = self.zapi.session.post(self.zapi.url,
+                                          data=json.dumps(request),
+                                          headers={'Content-Type': 'application/json-rpc'},
+                                          timeout=self.zapi.timeout,
+                                          stream=True)
+        try:
+            response.raise_for_status()
+            yield from iter_result(response.iter_content(self.chunk_size))
+        finally:
+            response.close()
@@ -0,0 +1,109 @@
+import types
+
+import pytest
+
+from ldapmulti import MultiLDAPConn
+
+
+class StubLDAPConn(object):
+    """
+    LDAPConn answering from the data of its source
+
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.connected = False
+
+    def connect(self):
+        if self.source.down:
+            raise SystemExit('Cannot connect to LDAP server: %s' % self.source.name)
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def search_groups_with_wildcard(self, groups_wildcard):
+        return list(self.source.groups)
+
+    def get_group_members(self, group):
+        members = self.source.groups.get(group)
+        return None if members is None else dict(members)
+
+    def get_user_attributes(self, dn, attributes):
+        return {a: self.source.users.get(dn, {}).get(a) for a in attributes}
+
+
+def source(name, precedence, groups, users=None, down=False):
+    return types.SimpleNamespace(name=name, precedence=precedence, groups=groups, users=users or {}, down=down)
+
+
+@pytest.fixture
+def multi():
+    # The sources are sorted by precedence, not by their order here
+    emea = source('emea', 1,
+                  {'sysadmins': {'alice': 'uid=alice,dc=emea', 'bob': 'uid=bob,dc=emea'},
+                   'operators': {'carol': 'uid=carol,dc=emea'}},
+                  {'uid=alice,dc=emea': {'mail': 'alice@emea.example.org'},
+                   'uid=bob,dc=emea': {'mail': 'bob@emea.example.org'}})
+    corp = source('corp', 0,
+                  {'sysadmins': {'dave': 'uid=dave,dc=corp'},
+                   'dba': {'alice': 'uid=alice,dc=corp'}},
+                  {'uid=alice,dc=corp': {'mail': 'alice@corp.example.org'}})
+
+    return MultiLDAPConn([emea, corp], StubLDAPConn)
+
+
+def test_precedence_across_groups(multi):
+    multi.prefetch(['sysadmins', 'operators', 'dba'])
+
+    # alice is only in the sysadmins group of emea, but corp wins everywhere
+    assert multi.get_group_members('sysadmins') == {'alice': 'uid=alice,dc=corp',
+                                                    'bob': 'uid=bob,dc=emea',
+                                                    'dave': 'uid=dave,dc=corp'}
+    assert multi.get_group_members('dba') == {'alice': 'uid=alice,dc=corp'}
+
+    assert multi.get_user_attributes('uid=alice,dc=corp', ['mail']) == {'mail': 'alice@corp.example.org'}
+    assert multi.get_user_attributes('uid=bob,dc=emea', ['mail']) == {'mail': 'bob@emea.example.org'}
+    assert multi.get_user_attributes('uid=alice,dc=emea', ['mail']) == {'mail': None}
+
+
+def test_group_in_one_source(multi):
+    multi.prefetch(['operators'])
+
+    assert multi.get_group_members('operators') == {'carol': 'uid=carol,dc=emea'}
+
+
+def test_group_in_no_source(multi):
+    multi.prefetch(['sysadmins', 'missing'])
+
+    assert multi.get_group_members('missing') is None
+    assert multi.get_group_members('sysadmins') is not None
+
+
+def test_group_fetched_on_demand(multi):
+    assert multi.get_group_members('dba') == {'alice': 'uid=alice,dc=corp'}
+    assert multi.get_group_members('missing') is None
+
+
+def test_wildcard_union():
+    multi = MultiLDAPConn([source('a', 0, {'g1': {}, 'g2': {}}), source('b', 1, {}), source('c', 2, {'g2': {}, 'g3': {}})],
+                          StubLDAPConn)
+
+    assert multi.get_groups_with_wildcard(['g*']) == ['g1', 'g2', 'g3']
+
+
+def test_wildcard_no_groups():
+    multi = MultiLDAPConn([source('a', 0, {}), source('b', 1, {})], StubLDAPConn)
+
+    with pytest.raises(SystemExit):
+        multi.get_groups_with_wildcard(['g*'])
+
+
+def test_connect_failure_disconnects():
+    multi = MultiLDAPConn([source('a', 0, {}), source('b', 1, {}, down=True), source('c', 2, {})], StubLDAPConn)
+
+    with pytest.raises(SystemExit):
+        multi.connect()
+
+    assert not any(conn.connected for conn in multi.conns)
@@ -0,0 +1,92 @@
+import gzip
+import json
+
+import pytest
+
+from ldapsnapshot import SnapshotLDAPConn, export_snapshot
+
+
+class StubLDAPConn(object):
+    """
+    LDAPConn answering from dicts
+
+    """
+
+    def __init__(self, groups, users):
+        self.groups = groups
+        self.users = users
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def prefetch(self, groups):
+        pass
+
+    def get_group_members(self, group):
+        return self.groups.get(group)
+
+    def get_user_attributes(self, dn, attributes):
+        return {a: self.users[dn].get(a) for a in attributes}
+
+
+GROUPS = {
+    'sysadmins': {'alice': 'uid=alice,dc=example,dc=org', 'bob': 'uid=bob,dc=example,dc=org'},
+    'dba': {'alice': 'uid=alice,dc=example,dc=org'},
+    'empty': {},
+}
+
+USERS = {
+    'uid=alice,dc=example,dc=org': {'givenName': 'Alice', 'sn': 'Liddell', 'mail': 'alice@example.org'},
+    'uid=bob,dc=example,dc=org': {'givenName': 'Bob', 'sn': None, 'mail': None},
+}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / 'ldap-snapshot.json.gz')
+    ldap_conn = StubLDAPConn(GROUPS, USERS)
+
+    export_snapshot(ldap_conn, ['sysadmins', 'dba', 'empty', 'missing'], ['givenName', 'sn', 'mail'], path)
+    assert not ldap_conn.connected
+
+    return path
+
+
+def test_round_trip(snapshot_path):
+    snapshot = SnapshotLDAPConn(snapshot_path)
+
+    assert sorted(snapshot.get_groups_with_wildcard(['*'])) == ['dba', 'empty', 'sysadmins']
+    for group, members in GROUPS.items():
+        assert snapshot.get_group_members(group) == members
+    assert snapshot.get_group_members('missing') is None
+
+    for dn, attributes in USERS.items():
+        assert snapshot.get_user_attributes(dn, ['givenName', 'sn', 'mail']) == attributes
+    assert snapshot.get_user_attributes('uid=alice,dc=example,dc=org', ['mail', 'mobile']) == \
+        {'mail': 'alice@example.org', 'mobile': None}
+    assert snapshot.get_user_attributes('uid=carol,dc=example,dc=org', ['mail']) == {'mail': None}
+
+
+def test_users_stored_once(snapshot_path):
+    with gzip.open(snapshot_path, 'rt', encoding='utf8') as f:
+        data = json.load(f)
+
+    assert len(data['users']) == 2
+    assert data['groups']['dba'] == [data['users'].index(['alice', 'uid=alice,dc=example,dc=org',
+                                                          'Alice', 'Liddell', 'alice@example.org'])]
+
+
+def test_unsupported_file(tmp_path):
+    path = str(tmp_path / 'other.json.gz')
+    with gzip.open(path, 'wt', encoding='utf8') as f:
+        json.dump({'format': 'other', 'version': 1}, f)
+
+    with pytest.raises(SystemExit):
+        SnapshotLDAPConn(path)
+
+    with pytest.raises(SystemExit):
+        SnapshotLDAPConn(str(tmp_path / 'missing.json.gz'))
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from sharding import LeaseLock, LeaseTimeout, select_shard
+
+
+USERS = ['user%d' % i for i in range(20)]
+
+
+def run_worker(lockdir, index, results, barrier):
+    locks = LeaseLock(lockdir, 'worker%d' % index, 60)
+    assert locks.start()
+
+    claimed = []
+    for user in USERS:
+        with locks.lease('user:%s' % user, 10):
+            # Read-modify-write, loses updates unless the lease serializes it
+            path = os.path.join(lockdir, 'counter-%s' % user)
+            count = int(open(path).read()) if os.path.exists(path) else 0
+            with open(path, 'w') as f:
+                f.write(str(count + 1))
+
+        if locks.claim('claim:%s' % user):
+            claimed.append(user)
+
+    results.put((index, claimed))
+
+    # Claims are only exclusive while their owners are running
+    barrier.wait(timeout=60)
+    locks.stop()
+
+
+def test_workers_share_lockdir(tmp_path):
+    lockdir = str(tmp_path)
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(3)
+
+    workers = [multiprocessing.Process(target=run_worker, args=(lockdir, i, results, barrier)) for i in range(3)]
+    for worker in workers:
+        worker.start()
+    claims = dict(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    for user in USERS:
+        assert open(os.path.join(lockdir, 'counter-%s' % user)).read() == '3'
+        owners = [index for index, claimed in claims.items() if user in claimed]
+        assert len(owners) == 1
+
+
+def test_select_shard_partitions_groups():
+    groups = ['group%d' % i for i in range(50)]
+    shards = [select_shard(groups, i, 3) for i in range(3)]
+
+    assert sorted(sum(shards, [])) == sorted(groups)
+
+
+def test_empty_lease_file_expires(tmp_path):
+    locks = LeaseLock(str(tmp_path), 'worker0', 1)
+    path = locks.path('user:x')
+    open(path, 'w').close()
+
+    with pytest.raises(LeaseTimeout):
+        with locks.lease('user:x', 0):
+            pass
+
+    old = time.time() - 10
+    os.utime(path, (old, old))
+
+    with locks.lease('user:x', 0):
+        assert locks.read(path)['owner'] == locks.owner
+
+
+def test_same_worker_runs_once(tmp_path):
+    first = LeaseLock(str(tmp_path), 'shard 0/2', 60)
+    second = LeaseLock(str(tmp_path), 'shard 0/2', 60)
+
+    assert first.start()
+    assert not second.start()
+
+    # Leases of one run are not held or released by the other one
+    assert first.acquire('user:x')
+    assert not second.acquire('user:x', timeout=0)
+    second.release('user:x')
+    assert not second.acquire('user:x', timeout=0)
+
+    first.stop()
+    assert second.start()
+    second.stop()
+
+
+def test_claims_follow_run_lease(tmp_path):
+    first = LeaseLock(str(tmp_path), 'shard 0/2', 60)
+    second = LeaseLock(str(tmp_path), 'shard 1/2', 60)
+
+    assert first.start()
+    assert first.claim('claim:x')
+    assert not second.claim('claim:x')
+    first.stop()
+
+    # The claim stays with the worker for its next run
+    again = LeaseLock(str(tmp_path), 'shard 0/2', 60)
+    assert again.start()
+    assert again.claim('claim:x')
+    assert not second.claim('claim:x')
+    again.stop()
+
+    # It is taken over while its owner is not running
+    assert second.claim('claim:x')
+
+
+def test_claims_of_dead_worker_are_taken_over(tmp_path):
+    first = LeaseLock(str(tmp_path), 'shard 0/2', 0.2)
+    second = LeaseLock(str(tmp_path), 'shard 1/2', 0.2)
+
+    # A run lease which is not renewed, as left by a worker which died
+    assert first.acquire('run:shard 0/2')
+    assert first.claim('claim:x')
+    assert not second.claim('claim:x')
+
+    time.sleep(0.3)
+    assert second.claim('claim:x')
+
+
+def test_run_lease_is_renewed(tmp_path):
+    first = LeaseLock(str(tmp_path), 'shard 0/2', 0.6)
+    second = LeaseLock(str(tmp_path), 'shard 1/2', 0.6)
+    third = LeaseLock(str(tmp_path), 'shard 0/2', 0.6)
+
+    assert first.start()
+    assert first.claim('claim:x')
+    time.sleep(1.0)
+
+    assert not second.claim('claim:x')
+    assert not third.start()
+    first.stop()
@@ -0,0 +1,95 @@
+import sqlite3
+import types
+
+import pytest
+
+from zabbixcaps import ZabbixCapabilities
+from zabbixdb import ZabbixDBSnapshot
+
+
+SCHEMA = """
+CREATE TABLE users (userid INTEGER PRIMARY KEY, {username} VARCHAR(100) NOT NULL);
+CREATE TABLE usrgrp (usrgrpid INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL, users_status INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE users_groups (id INTEGER PRIMARY KEY, usrgrpid INTEGER NOT NULL, userid INTEGER NOT NULL);
+CREATE TABLE media_type (mediatypeid INTEGER PRIMARY KEY, type INTEGER NOT NULL);
+CREATE TABLE media (mediaid INTEGER PRIMARY KEY, userid INTEGER NOT NULL, mediatypeid INTEGER NOT NULL,
+                    sendto VARCHAR(1024) NOT NULL, active INTEGER NOT NULL, severity INTEGER NOT NULL,
+                    period VARCHAR(1024) NOT NULL);
+
+INSERT INTO users VALUES (1, 'Admin'), (2, 'alice'), (3, 'bob');
+INSERT INTO usrgrp VALUES (7, 'Zabbix administrators', 0), (8, 'sysadmins', 0), (9, 'Disabled', 1);
+INSERT INTO users_groups VALUES (1, 7, 1), (2, 8, 2), (3, 8, 3), (4, 9, 3);
+INSERT INTO media_type VALUES (1, 0), (3, 2);
+INSERT INTO media VALUES (10, 2, 1, 'alice@example.org' || char(10) || 'alice@example.com', 0, 63, '1-7,00:00-24:00'),
+                         (11, 3, 3, '+15550100', 1, 48, '1-5,09:00-18:00');
+"""
+
+
+def create_database(path, username_field):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA.format(username=username_field))
+    conn.close()
+
+
+def load_snapshot(tmp_path, version):
+    caps = ZabbixCapabilities(version)
+    path = str(tmp_path / 'zabbix.db')
+    create_database(path, caps.username_field)
+
+    config = types.SimpleNamespace(zbxdb_driver='sqlite3', zbxdb_params=[('database', path)])
+    snapshot = ZabbixDBSnapshot(config)
+    snapshot.load(caps)
+
+    return snapshot
+
+
+def test_load(tmp_path):
+    snapshot = load_snapshot(tmp_path, '6.0.1')
+
+    assert snapshot.users == {'Admin': '1', 'alice': '2', 'bob': '3'}
+    assert snapshot.groups == {'Zabbix administrators': '7', 'sysadmins': '8'}
+    assert sorted(snapshot.get_group_members('8')) == ['alice', 'bob']
+    assert snapshot.get_group_members('9') == []
+
+    assert snapshot.medias['1'] == []
+    assert snapshot.medias['2'] == [{
+        'mediaid': '10',
+        'mediatypeid': '1',
+        'sendto': ['alice@example.org', 'alice@example.com'],
+        'active': '0',
+        'severity': '63',
+        'period': '1-7,00:00-24:00',
+    }]
+    assert snapshot.medias['3'][0]['sendto'] == '+15550100'
+
+
+def test_load_alias_column(tmp_path):
+    snapshot = load_snapshot(tmp_path, '5.0.10')
+
+    assert snapshot.users['alice'] == '2'
+
+
+def test_load_before_sendto_list(tmp_path):
+    snapshot = load_snapshot(tmp_path, '3.4.15')
+
+    assert snapshot.medias['2'][0]['sendto'] == 'alice@example.org\nalice@example.com'
+
+
+def test_changes_are_recorded(tmp_path):
+    snapshot = load_snapshot(tmp_path, '6.0.1')
+
+    snapshot.add_group('operators', '12')
+    snapshot.add_user('carol', '4')
+    snapshot.add_member('12', '4')
+    assert snapshot.get_group_members('12') == ['carol']
+
+    snapshot.remove_user('bob')
+    assert snapshot.get_group_members('8') == ['alice']
+    assert '3' not in snapshot.medias
+
+
+def test_missing_driver(tmp_path):
+    config = types.SimpleNamespace(zbxdb_driver='no_such_driver', zbxdb_params=[])
+
+    with pytest.raises(SystemExit):
+        ZabbixDBSnapshot(config).load(ZabbixCapabilities('6.0.1'))
@@ -0,0 +1,35 @@
+import pytest
+
+from zabbixldapconf import ZabbixLDAPConf
+
+
+CONFIG = """
+[ldap]
+type = activedirectory
+groups = sysadmins
+
+[zabbix]
+server = http://zabbix.example.org/zabbix/
+username = admin
+password = adminp4ssw0rd
+auth = webform
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / 'zabbix-ldap.conf'
+    path.write_text(CONFIG)
+    return str(path)
+
+
+def test_ldap_server_required(config_file):
+    with pytest.raises(SystemExit):
+        ZabbixLDAPConf(config_file)
+
+
+def test_ldap_server_optional_from_snapshot(config_file):
+    config = ZabbixLDAPConf(config_file, from_snapshot=True)
+
+    assert config.ldap_uri is None
+    assert config.ldap_groups == ['sysadmins']
@@ -0,0 +1,67 @@
+import json
+import logging
+import types
+
+import pytest
+
+from zabbixldaplog import USER_LOGGER, setup_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    logging.getLogger(USER_LOGGER).setLevel(logging.NOTSET)
+
+
+def run_logging(capsys, log_format, log):
+    config = types.SimpleNamespace(verbose=False, log_format=log_format, log_peruser=True)
+    listener = setup_logging(config)
+    try:
+        log()
+    finally:
+        listener.stop()
+
+    return capsys.readouterr().err.splitlines()
+
+
+def test_json_exception(capsys, restore_logging):
+    def log():
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logging.getLogger().exception('Sync of %s failed', 'sysadmins')
+
+    lines = run_logging(capsys, 'json', log)
+
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry['message'] == 'Sync of sysadmins failed'
+    assert 'ValueError: broken' in entry['exception']
+
+
+def test_json_fields(capsys, restore_logging):
+    def log():
+        logging.getLogger(USER_LOGGER).info('Deleting user: "%s"', 'alice',
+                                            extra={'fields': {'user': 'alice', 'group': 'sysadmins', 'action': 'delete'}})
+
+    entry = json.loads(run_logging(capsys, 'json', log)[0])
+
+    assert entry['message'] == 'Deleting user: "alice"'
+    assert (entry['user'], entry['group'], entry['action']) == ('alice', 'sysadmins', 'delete')
+
+
+def test_text_exception(capsys, restore_logging):
+    def log():
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logging.getLogger().exception('Sync failed')
+
+    lines = run_logging(capsys, 'text', log)
+
+    assert lines[0].endswith(' - ERROR - Sync failed')
+    assert lines[-1] == 'ValueError: broken'
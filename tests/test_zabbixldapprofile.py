@@ -0,0 +1,29 @@
+import os
+
+from zabbixldapprofile import PhaseProfiler
+
+
+def allocate():
+    return ['user%d' % i for i in range(20000)]
+
+
+def test_phase_files(tmp_path):
+    profiler = PhaseProfiler(str(tmp_path))
+    try:
+        with profiler.phase('group sysadmins'):
+            users = allocate()
+    finally:
+        profiler.close()
+
+    assert len(users) == 20000
+    assert sorted(os.listdir(str(tmp_path))) == ['001-group_sysadmins.alloc.txt', '001-group_sysadmins.folded',
+                                                 '001-group_sysadmins.pstats']
+
+    allocations = (tmp_path / '001-group_sysadmins.alloc.txt').read_text().splitlines()[3:]
+    assert allocations[0].startswith(__file__)
+    for line in allocations:
+        assert '/tracemalloc.py' not in line
+        assert '/cProfile.py' not in line
+        assert '/zabbixldapprofile.py' not in line
+
+    assert 'test_zabbixldapprofile.py' in (tmp_path / '001-group_sysadmins.folded').read_text()
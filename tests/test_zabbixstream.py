@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+pytest.importorskip('pyzabbix')
+
+from pyzabbix import ZabbixAPIException
+
+from zabbixstream import iter_result
+
+
+def split(text, size):
+    data = text.encode('utf8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_items_split_across_chunks(size):
+    result = [12345, 6, -1.5e3, 'näme', True, None, {'userid': '1', 'username': 'a'}, [1, 2]]
+    text = json.dumps({'jsonrpc': '2.0', 'result': result, 'id': 1})
+
+    assert list(iter_result(split(text, size))) == result
+
+
+def test_scalar_result():
+    assert list(iter_result(split('{"jsonrpc": "2.0", "result": 42, "id": 1}', 4))) == [42]
+
+
+def test_error_response():
+    text = json.dumps({'jsonrpc': '2.0', 'error': {'code': -32602, 'message': 'Invalid params.', 'data': 'x'}, 'id': 1})
+
+    with pytest.raises(ZabbixAPIException):
+        list(iter_result(split(text, 5)))
+
+
+def test_truncated_response():
+    with pytest.raises(ZabbixAPIException):
+        list(iter_result(split('{"jsonrpc": "2.0", "result": [1, 2, 345', 3)))